@@ -0,0 +1,90 @@
+"""Per-user log of task completions.
+
+data['completions'][user_id] holds {'user_id': ..., 'events': [[timestamp, task_id], ...]}
+sorted by timestamp.  Timestamps are ISO strings, which sort in time order, so
+"how many completions between A and B" is two binary searches instead of
+re-parsing every task's completed_dates.
+"""
+from bisect import bisect_left, insort
+from datetime import datetime, time, timedelta
+
+# Named windows a challenge template can restrict completions to: (from, until) time of day
+TIME_CONSTRAINTS = {
+    'after_8pm': (time(20, 0), None),
+}
+
+
+def completion_log(data, user_id):
+    """The user's completion log row, created if missing"""
+    return data.setdefault('completions', {}).setdefault(user_id, {'user_id': user_id, 'events': []})
+
+
+def record_completion(log, task_id, at):
+    event = [at.isoformat(timespec='seconds'), task_id]
+    events = log['events']
+    # Completions arrive in time order, so this is nearly always an append
+    if not events or events[-1] <= event:
+        events.append(event)
+    else:
+        insort(events, event)
+
+
+def _position(events, when):
+    # Events are stored to the second, so bounds are compared at that precision
+    return bisect_left(events, [when.isoformat(timespec='seconds')])
+
+
+def count_between(log, start, end=None):
+    """Completions with start <= time < end (end=None: up to now), to the second"""
+    events = log.get('events', [])
+    high = _position(events, end) if end is not None else len(events)
+    return max(high - _position(events, start), 0)
+
+
+def events_between(log, start, end):
+    """The [timestamp, task_id] events with start <= time < end, oldest first"""
+    events = log.get('events', [])
+    return events[_position(events, start):_position(events, end)]
+
+
+def daily_totals(events, tasks):
+    """Completions, XP and coins per day for events of the given tasks"""
+    days = {}
+    for timestamp, task_id in events:
+        task = tasks.get(task_id)
+        if task is None:
+            continue
+        day = days.setdefault(timestamp[:10], {'date': timestamp[:10], 'count': 0, 'xp': 0, 'coins': 0})
+        day['count'] += 1
+        day['xp'] += task.get('xp_reward', 0)
+        day['coins'] += task.get('coin_reward', 0)
+    return list(days.values())
+
+
+def count_in_daily_window(log, start, end, window_start, window_end=None):
+    """Completions between start and end that fall in [window_start, window_end) on their day"""
+    total = 0
+    day = start.date()
+    while day <= end.date():
+        low = max(datetime.combine(day, window_start), start)
+        high = datetime.combine(day, window_end) if window_end else datetime.combine(day + timedelta(days=1), time())
+        high = min(high, end)
+        if low < high:
+            total += count_between(log, low, high)
+        day += timedelta(days=1)
+    return total
+
+
+def in_time_constraint(at, constraint=None):
+    """Whether a completion at this time counts under a challenge's time_constraint"""
+    if constraint not in TIME_CONSTRAINTS:
+        return True
+    window_start, window_end = TIME_CONSTRAINTS[constraint]
+    return at.time() >= window_start and (window_end is None or at.time() < window_end)
+
+
+def count_for_constraint(log, start, end, constraint=None):
+    """Completions counted towards a challenge with an optional time_constraint"""
+    if constraint in TIME_CONSTRAINTS:
+        return count_in_daily_window(log, start, end, *TIME_CONSTRAINTS[constraint])
+    return count_between(log, start, end)
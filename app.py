@@ -1,15 +1,29 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for
+import click
 import json
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import uuid
 import csv
-from werkzeug.security import generate_password_hash, check_password_hash
+import copy
+import hashlib
 from werkzeug.utils import secure_filename
 from functools import wraps
 import firebase_admin
 import firebase_auth
 from firebase_admin import credentials, db
+from activity import completion_log, daily_totals, events_between, record_completion
+from events import EventHub, sse_stream
+from feed import SocialFeed, decode_cursor
+from leaderboard import Leaderboards
+from migrations import SCHEMA_VERSION, migrate_document, run_migrations
+from passwords import PasswordHasher, PasswordPoolBusy
+from recurrence import agenda, longest_period
+from reminders import ReminderIndex, ReminderTicker
+from scheduler import ExpiryScheduler
+from storage import CODECS, ConflictError, LockStripes, create_store, decode_row, read_snapshot, write_snapshot
+from sync import changes_since, task_sync, tombstone, touch_task
+import rules
 
 # Initialize Flask app ONCE
 app = Flask(__name__)
@@ -24,13 +38,101 @@ try:
 except Exception as e:
     print("Error initializing Firebase:", e)
 
+# How often a handler is re-run when its save conflicts with another request
+SAVE_RETRIES = 5
+# Handler runs re-tried after a ConflictError in this process (reported by stress-test)
+save_conflicts = 0
+
+def user_transaction(f):
+    """Run a handler under the caller's lock stripe and re-run it on save conflicts.
+
+    The stripe lock keeps requests of the same user (in any worker process)
+    from interleaving; ConflictError still catches writes to rows shared with
+    other users, such as pending challenges.  GET and HEAD requests of
+    handlers that also write (theme, settings) only read, so they skip both.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        global save_conflicts
+        user_id = get_user_id()
+        if not user_id or request.method in ('GET', 'HEAD'):
+            return f(*args, **kwargs)
+        for attempt in range(SAVE_RETRIES):
+            try:
+                with user_locks.hold(user_id):
+                    return f(*args, **kwargs)
+            except ConflictError:
+                save_conflicts += 1
+                continue
+        return jsonify({'error': 'Too many concurrent updates, please retry'}), 409
+    return decorated_function
+
+@app.errorhandler(ConflictError)
+def handle_conflict(error):
+    return jsonify({'error': 'Your data changed while saving, please retry'}), 409
+
+def conditional_get(*versions):
+    """Answer If-None-Match with 304 while the client's copy is still current.
+
+    Each version() returns a (tag, modified datetime) pair for one input of
+    the response, or None if it is unknown.  They are read before the handler
+    runs, so a match never loads the store; the ETag combines all of them.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            parts = [version() for version in versions]
+            if None in parts:
+                return f(*args, **kwargs)
+            etag = hashlib.sha1('|'.join(tag for tag, modified in parts).encode()).hexdigest()[:20]
+            modified = max(modified for tag, modified in parts)
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.last_modified = modified
+            # Per-user data: browsers may keep it but must revalidate each time
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+def user_data_version():
+    user_id = get_user_id()
+    version = store.user_version(user_id) if user_id else None
+    if version is None:
+        return None
+    return f'{user_id}:{version[0]}', version[1]
+
+def catalog_tag(templates):
+    return hashlib.sha1(json.dumps(templates, sort_keys=True).encode()).hexdigest()
+
+def quest_catalog_version():
+    return CATALOG_VERSIONS['quests']
+
+def challenge_catalog_version():
+    return CATALOG_VERSIONS['challenges']
+
+# Boards are per-process indexes, so their version is only meaningful with the process id
+PROCESS_TAG = uuid.uuid4().hex
+
+def leaderboards_version():
+    leaderboards.ensure_fresh(user_summaries)
+    return (f'{os.getpid()}:{PROCESS_TAG}:{leaderboards.version}',
+            datetime.fromtimestamp(leaderboards.changed_at))
+
 @app.route('/api/quests/<quest_id>', methods=['DELETE'])
+@user_transaction
 def abandon_quest(quest_id):
     """Abandon an active quest"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
     
     if quest_id not in data['quests'] or data['quests'][quest_id].get('user_id') != user_id:
         return jsonify({'error': 'Quest not found'}), 404
@@ -39,12 +141,13 @@ def abandon_quest(quest_id):
         if quest_id in data['active_quests'][user_id]:
             data['active_quests'][user_id].remove(quest_id)
     
-    save_data(data)
+    save_data(data, 'quest_abandoned')
     return jsonify({'message': 'Quest abandoned'})
 
 # ============ CHALLENGES ENDPOINTS ============
 
 @app.route('/api/challenge-templates', methods=['GET'])
+@conditional_get(challenge_catalog_version)
 def get_challenge_templates():
     """Get available challenge templates"""
     return jsonify({'templates': CHALLENGE_TEMPLATES})
@@ -75,27 +178,35 @@ def add_challenge_template():
         'icon': challenge_data.get('icon', '🎯'),
         **{k: v for k, v in challenge_data.items() if k not in ['id','name','description','difficulty','tasks_required','duration_hours','xp_reward','coin_reward','icon']}
     }
+    CATALOG_VERSIONS['challenges'] = (catalog_tag(CHALLENGE_TEMPLATES), datetime.now())
     return jsonify({'message': 'Challenge template added!', 'template': CHALLENGE_TEMPLATES[template_id]})
 
+@app.route('/api/storage/stats', methods=['GET'])
+def storage_stats():
+    """Storage backend counters such as cache hits/misses (admin only)"""
+    if session.get('username') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'stats': store.stats()})
+
 # ============ SOCIAL / FRIEND CHALLENGES ============
 
 @app.route('/api/users', methods=['GET'])
 def list_users():
     """Return a list of users (id, username)"""
-    data = load_data()
     users = []
-    for uid, user in data.get('users', {}).items():
+    for uid, user in user_summaries().items():
         users.append({'id': uid, 'username': user.get('username', 'Player')})
     return jsonify({'users': users})
 
 @app.route('/api/share-achievement', methods=['POST'])
+@user_transaction
 def share_achievement():
     """Share an achievement to the social feed"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    data = load_data()
+    data = load_data(user_id)
     user = initialize_user(data, user_id)
 
     payload = request.json
@@ -118,27 +229,34 @@ def share_achievement():
     if 'social' not in data:
         data['social'] = {}
     data['social'][share_id] = share
-    save_data(data)
+    save_data(data, 'achievement_shared')
 
     return jsonify({'message': 'Achievement shared!', 'share': share})
 
 @app.route('/api/social-feed', methods=['GET'])
 def social_feed():
-    """Return recent shared achievements"""
-    data = load_data()
-    shares = list(data.get('social', {}).values())
-    # Sort by timestamp desc
-    shares.sort(key=lambda s: s.get('timestamp', ''), reverse=True)
-    return jsonify({'shares': shares})
+    """Return one page of recent shared achievements, newest first"""
+    social_index.ensure_fresh(load_social_shares)
+    
+    limit = min(max(request.args.get('limit', 20, type=int), 1), SOCIAL_FEED_PAGE_LIMIT)
+    try:
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    shares, next_cursor, prev_cursor = social_index.page(limit, before, after, social_retention_start())
+    return jsonify({'shares': shares, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor})
 
 @app.route('/api/challenge-friend', methods=['POST'])
+@user_transaction
 def challenge_friend():
     """Send a challenge invitation to a friend"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    data = load_data()
+    data = load_data(user_id)
     payload = request.json
     friend_id = payload.get('friend_id')
     template_id = payload.get('template_id', 'daily_grind')
@@ -150,7 +268,7 @@ def challenge_friend():
         return jsonify({'error': 'Cannot challenge yourself'}), 400
 
     # Validate friend exists
-    if friend_id not in data.get('users', {}):
+    if not user_exists(friend_id):
         return jsonify({'error': 'Friend not found'}), 404
 
     if template_id not in CHALLENGE_TEMPLATES:
@@ -170,29 +288,33 @@ def challenge_friend():
     if 'pending_challenges' not in data:
         data['pending_challenges'] = {}
     data['pending_challenges'][pending_id] = pending
-    save_data(data)
+    save_data(data, 'challenge_sent')
 
     return jsonify({'message': 'Challenge sent!', 'pending': pending})
 
 @app.route('/api/pending-challenges', methods=['GET'])
 def get_pending_challenges():
     """Get pending challenges for current user"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
-    pending = [p for p in data.get('pending_challenges', {}).values() if p.get('to_user') == user_id]
+    now = datetime.now()
+    pending = [p for p in data.get('pending_challenges', {}).values()
+               if p.get('to_user') == user_id and p.get('status') != 'expired'
+               and not (p.get('status') == 'pending' and expiry_time('pending_challenges', p) <= now)]
     return jsonify({'pending': pending})
 
 @app.route('/api/pending-challenges/<pending_id>/respond', methods=['POST'])
+@user_transaction
 def respond_pending_challenge(pending_id):
     """Accept or decline a pending challenge"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    data = load_data()
+    data = load_data(user_id)
 
     if pending_id not in data.get('pending_challenges', {}):
         return jsonify({'error': 'Pending challenge not found'}), 404
@@ -200,6 +322,10 @@ def respond_pending_challenge(pending_id):
     pending = data['pending_challenges'][pending_id]
     if pending.get('to_user') != user_id:
         return jsonify({'error': 'Not your challenge to respond to'}), 403
+    
+    expires_at = expiry_time('pending_challenges', pending)
+    if pending.get('status') == 'expired' or (expires_at is not None and expires_at <= datetime.now()):
+        return jsonify({'error': 'Challenge invitation expired'}), 400
 
     payload = request.json
     accept = bool(payload.get('accept', False))
@@ -211,7 +337,7 @@ def respond_pending_challenge(pending_id):
         # Create challenge for the accepting user
         template_id = pending.get('template_id')
         if template_id not in CHALLENGE_TEMPLATES:
-            save_data(data)
+            save_data(data, 'challenge_answered')
             return jsonify({'error': 'Challenge template no longer available'}), 400
 
         template = CHALLENGE_TEMPLATES[template_id]
@@ -236,18 +362,20 @@ def respond_pending_challenge(pending_id):
 
         if 'challenges' not in data:
             data['challenges'] = {}
+        rules_engine.seed_challenge(new_challenge, data)
         data['challenges'][challenge_id] = new_challenge
 
-    save_data(data)
+    save_data(data, 'challenge_answered')
     return jsonify({'message': 'Response recorded', 'pending': pending})
 
 @app.route('/api/challenges', methods=['GET'])
+@conditional_get(user_data_version, challenge_catalog_version)
 def get_challenges():
     """Get all challenges for current user"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     user = initialize_user(data, user_id)
     
@@ -271,15 +399,13 @@ def get_challenges():
                     challenge_data['time_remaining_seconds'] = int(time_remaining)
                     active_challenges.append(challenge_data)
                 else:
-                    # Challenge expired
-                    challenge['completed'] = True
-                    challenge['expired'] = True
+                    # Expired; the expiry scheduler will record it
+                    challenge_data['completed'] = True
+                    challenge_data['expired'] = True
                     completed_challenges.append(challenge_data)
             else:
                 completed_challenges.append(challenge_data)
     
-    save_data(data)
-    
     return jsonify({
         'active': active_challenges,
         'completed': completed_challenges,
@@ -287,12 +413,13 @@ def get_challenges():
     })
 
 @app.route('/api/challenges', methods=['POST'])
+@user_transaction
 def create_challenge():
     """Start a new challenge from template"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     user = initialize_user(data, user_id)
     
@@ -326,8 +453,9 @@ def create_challenge():
     if 'challenges' not in data:
         data['challenges'] = {}
     
+    rules_engine.seed_challenge(new_challenge, data)
     data['challenges'][challenge_id] = new_challenge
-    save_data(data)
+    save_data(data, 'challenge_started')
     
     return jsonify({
         'challenge': new_challenge,
@@ -335,13 +463,14 @@ def create_challenge():
     })
 
 @app.route('/api/challenges/<challenge_id>/check', methods=['POST'])
+@user_transaction
 
 def check_challenge_progress(challenge_id):
     """Check challenge progress"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     user = initialize_user(data, user_id)
     
@@ -353,122 +482,118 @@ def check_challenge_progress(challenge_id):
     if challenge['completed']:
         return jsonify({'error': 'Challenge already completed'}), 400
     
-    template_id = challenge['template_id']
-    template = CHALLENGE_TEMPLATES[template_id]
-    
-    # Count tasks completed since challenge started
-    challenge_start = datetime.fromisoformat(challenge['started_at'])
-    tasks_completed_since = 0
+    # Progress is kept up to date as tasks are completed
+    level_before = user['level']
+    rules_engine.process(data, user_id, [rules.checked()])
     
-    for task in data['tasks'].values():
-        if task.get('user_id') == user_id:
-            for completed_date in task.get('completed_dates', []):
-                completed_datetime = datetime.fromisoformat(completed_date + 'T00:00:00')
-                if completed_datetime >= challenge_start:
-                    tasks_completed_since += 1
-    
-    progress = tasks_completed_since
-    completed = progress >= template['tasks_required']
-    
-    challenge['progress'] = progress
-    
-    if completed and not challenge['completed']:
-        challenge['completed'] = True
-        challenge['completed_at'] = datetime.now().isoformat()
-        
-        # Award rewards
-        user['xp'] += challenge['xp_reward']
-        user['coins'] += challenge['coin_reward']
-        user['total_coins_earned'] += challenge['coin_reward']
-        
-        # Check for level up
-        xp_for_next_level = user['level'] * 100
-        level_up = False
-        while user['xp'] >= xp_for_next_level:
-            user['level'] += 1
-            user['xp'] -= xp_for_next_level
-            xp_for_next_level = user['level'] * 100
-            level_up = True
-            user['coins'] += 50
-        
-        save_data(data)
+    if challenge['completed']:
+        save_data(data, 'challenge_completed')
         
         return jsonify({
             'completed': True,
             'xp_reward': challenge['xp_reward'],
             'coin_reward': challenge['coin_reward'],
             'user': user,
-            'level_up': level_up,
+            'level_up': user['level'] > level_before,
             'message': f'Challenge completed: {challenge["name"]}!'
         })
     
-    save_data(data)
+    save_data(data, 'challenge_checked')
     
+    required = rules_engine.challenge_required(challenge)
     return jsonify({
         'completed': False,
-        'progress': progress,
-        'required': template['tasks_required'],
-        'message': f'Progress: {progress}/{template["tasks_required"]}'
+        'progress': challenge['progress'],
+        'required': required,
+        'message': f'Progress: {challenge["progress"]}/{required}'
     })
 
+# ============ EVENTS ENDPOINTS ============
+
+@app.route('/api/events')
+def event_stream():
+    """Server-Sent Events for the current user (reminders and game state deltas)"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    stream = sse_stream(event_hub, user_id, SSE_HEARTBEAT_SECONDS, lambda: store.user_version(user_id))
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ============ LEADERBOARDS ENDPOINTS ============
 
 @app.route('/api/leaderboards', methods=['GET'])
+@conditional_get(user_data_version, leaderboards_version)
 
 def get_leaderboards():
     """Get global leaderboards"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     current_user = initialize_user(data, user_id)
+    leaderboards.ensure_fresh(user_summaries)
     
-    # Create user list with stats
-    users_list = []
-    for uid, user in data['users'].items():
-        total_earned = user.get('coins', 0) + sum(SHOP_ITEMS[item]['cost'] 
-                                                   for item in user.get('inventory', []) 
-                                                   if item in SHOP_ITEMS)
-        users_list.append({
-            'id': uid,
-            'username': user.get('username', 'Player'),
-            'level': user.get('level', 1),
-            'xp': user.get('xp', 0),
-            'coins': user.get('coins', 0),
-            'total_coins_earned': total_earned,
-            'streak': user.get('streak', 0),
-            'total_tasks_completed': user.get('total_tasks_completed', 0),
-            'badges_count': len(user.get('badges', [])),
-            'is_current_user': uid == user_id
-        })
+    # Top 50 of each board, read straight from the maintained rankings
+    boards = {name: [leaderboard_row(entry, user_id) for entry in leaderboards.page(name, 0, 50)]
+              for name in LEADERBOARD_METRICS}
     
-    # Sort by different criteria
-    by_level = sorted(users_list, key=lambda x: (-x['level'], -x['xp']))
-    by_xp = sorted(users_list, key=lambda x: -x['xp'])
-    by_coins = sorted(users_list, key=lambda x: -x['coins'])
-    by_streak = sorted(users_list, key=lambda x: -x['streak'])
-    by_tasks = sorted(users_list, key=lambda x: -x['total_tasks_completed'])
-    
-    # Add rank to each leaderboard
-    for i, user in enumerate(by_level):
-        user['rank_level'] = i + 1
-    for i, user in enumerate(by_xp):
-        user['rank_xp'] = i + 1
-    for i, user in enumerate(by_coins):
-        user['rank_coins'] = i + 1
-    for i, user in enumerate(by_streak):
-        user['rank_streak'] = i + 1
-    for i, user in enumerate(by_tasks):
-        user['rank_tasks'] = i + 1
+    return jsonify({**boards, 'current_user': current_user})
+
+@app.route('/api/leaderboards/<board>', methods=['GET'])
+def get_leaderboard_page(board):
+    """One page of a leaderboard, by offset or after a cursor"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if board not in LEADERBOARD_METRICS:
+        return jsonify({'error': 'Leaderboard not found'}), 404
+    leaderboards.ensure_fresh(user_summaries)
+    
+    limit = min(max(request.args.get('limit', 50, type=int), 1), LEADERBOARD_PAGE_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    cursor = request.args.get('cursor')
+    if cursor:
+        # The cursor is the id of the last user on the previous page
+        rank = leaderboards.rank(board, cursor)
+        if rank is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        offset = rank
+    
+    entries = [leaderboard_row(entry, user_id) for entry in leaderboards.page(board, offset, limit)]
+    has_more = offset + len(entries) < len(leaderboards)
+    return jsonify({
+        'board': board,
+        'offset': offset,
+        'total': len(leaderboards),
+        'entries': entries,
+        'next_offset': offset + len(entries) if has_more else None,
+        'next_cursor': entries[-1]['id'] if has_more and entries else None
+    })
+
+@app.route('/api/leaderboards/<board>/around-me', methods=['GET'])
+def get_leaderboard_around_me(board):
+    """The current user's rank with the users just above and below them"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if board not in LEADERBOARD_METRICS:
+        return jsonify({'error': 'Leaderboard not found'}), 404
+    data = load_data(user_id)
+    initialize_user(data, user_id)
+    leaderboards.ensure_fresh(user_summaries)
+    
+    radius = min(max(request.args.get('radius', 5, type=int), 0), LEADERBOARD_PAGE_LIMIT)
+    rank, entries = leaderboards.around(board, user_id, radius)
+    if rank is None:
+        return jsonify({'error': 'User not ranked yet'}), 404
     
     return jsonify({
-        'by_level': by_level[:50],  # Top 50
-        'by_xp': by_xp[:50],
-        'by_coins': by_coins[:50],
-        'by_streak': by_streak[:50],
-        'by_tasks': by_tasks[:50],
-        'current_user': current_user
+        'board': board,
+        'rank': rank,
+        'total': len(leaderboards),
+        'entries': [leaderboard_row(entry, user_id) for entry in entries]
     })
 
 # ============ PAGE ROUTES ============
@@ -477,18 +602,13 @@ def get_leaderboards():
 
 def profile():
     """User profile page"""
-    data = load_data()
     user_id = get_user_id()
+    data = load_data(user_id)
     user = initialize_user(data, user_id)
     
     # Store username in user data 
     user['username'] = session['username']
     
-    # Initialize inventory if doesn't exist
-    if 'inventory' not in user:
-        user['inventory'] = []
-        save_data(data)
-    
     # Get user's purchased items
     purchased_items = [
         {**SHOP_ITEMS[item], 'id': item}
@@ -521,38 +641,95 @@ def calendar():
 
 def get_calendar_tasks():
     """Get tasks for calendar view with date range"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     initialize_user(data, user_id)
     
-    # Get date range from query params (default: current month)
+    # Get date range from query params (default: current month, end exclusive)
+    month_start = datetime.combine(datetime.now().date().replace(day=1), datetime.min.time())
     try:
-        start_date = request.args.get('start', datetime.now().replace(day=1).isoformat())
-        end_date = request.args.get('end', (datetime.now().replace(day=1) + timedelta(days=32)).replace(day=1).isoformat())
-    except:
-        start_date = datetime.now().replace(day=1).isoformat()
-        end_date = (datetime.now().replace(day=1) + timedelta(days=32)).replace(day=1).isoformat()
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else month_start
+        end = (datetime.fromisoformat(request.args['end']) if request.args.get('end')
+               else (month_start + timedelta(days=32)).replace(day=1))
+    except ValueError:
+        return jsonify({'error': 'Invalid date range'}), 400
     
-    # Collect user's tasks with completion data
-    user_tasks = [task for task in data['tasks'].values() if task.get('user_id') == user_id]
+    # Only the completions inside the range, found by binary search in the user's log
+    events = events_between(completion_log(data, user_id), start, end)
+    
+    if request.args.get('mode') == 'daily':
+        # Per-day totals for heatmaps, without the individual completions
+        return jsonify({'days': daily_totals(events, data['tasks']),
+                        'start_date': start.isoformat(), 'end_date': end.isoformat()})
+    
+    result = {'start_date': start.isoformat(), 'end_date': end.isoformat()}
+    if request.args.get('occurrences') in ('1', 'true'):
+        # Done, missed and upcoming occurrences of recurring tasks in the range
+        result['occurrences'] = task_occurrences(data, user_id, start.date(), end.date())
     
     calendar_data = []
-    for task in user_tasks:
-        for completed_date in task.get('completed_dates', []):
-            calendar_data.append({
-                'id': task['id'],
-                'title': task['title'],
-                'date': completed_date,
-                'xp': task.get('xp_reward', 0),
-                'coins': task.get('coin_reward', 0),
-                'recurring': task.get('recurring', False),
-                'frequency': task.get('frequency', 'daily')
-            })
-    
-    return jsonify({'tasks': calendar_data, 'start_date': start_date, 'end_date': end_date})
+    for timestamp, task_id in events:
+        task = data['tasks'].get(task_id)
+        if task is None:
+            continue
+        calendar_data.append({
+            'id': task['id'],
+            'title': task['title'],
+            'date': timestamp[:10],
+            'completed_at': timestamp,
+            'xp': task.get('xp_reward', 0),
+            'coins': task.get('coin_reward', 0),
+            'recurring': task.get('recurring', False),
+            'frequency': task.get('frequency', 'daily')
+        })
+    
+    return jsonify({'tasks': calendar_data, **result})
+
+@app.route('/api/agenda')
+def get_agenda():
+    """Occurrences of the user's recurring tasks for the coming days"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
+        
+    initialize_user(data, user_id)
+    
+    try:
+        start = datetime.fromisoformat(request.args['start']).date() if request.args.get('start') else datetime.now().date()
+    except ValueError:
+        return jsonify({'error': 'Invalid start date'}), 400
+    days = min(max(request.args.get('days', 7, type=int), 1), 366)
+    end = start + timedelta(days=days)
+    
+    return jsonify({'occurrences': task_occurrences(data, user_id, start, end),
+                    'start_date': start.isoformat(), 'end_date': end.isoformat()})
+
+def task_occurrences(data, user_id, start, end):
+    """API entries for the occurrences of the user's recurring tasks from start to end (dates, end exclusive)"""
+    tasks = [task for task in data['tasks'].values() if task.get('user_id') == user_id]
+    # Completions up to one period past the end decide whether the last occurrences were done
+    events = events_between(completion_log(data, user_id), datetime.combine(start, datetime.min.time()),
+                            datetime.combine(end + timedelta(days=longest_period(tasks)), datetime.min.time()))
+    # Fields that are the same for every occurrence of a task, built once
+    base = {task['id']: {
+        'id': task['id'],
+        'title': task['title'],
+        'scheduled_time': task.get('scheduled_time', ''),
+        'xp': task.get('xp_reward', 0),
+        'coins': task.get('coin_reward', 0),
+        'frequency': task.get('frequency', 'daily')
+    } for task in tasks}
+    day_text = {}
+    entries = []
+    for day, task, status in agenda(tasks, events, start, end, datetime.now().date()):
+        if day not in day_text:
+            day_text[day] = date.fromordinal(day).isoformat()
+        entries.append({**base[task['id']], 'date': day_text[day], 'status': status})
+    return entries
 
 # ============ AVATAR UPLOAD ============
 
@@ -567,6 +744,7 @@ def allowed_avatar_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_AVATAR_EXTENSIONS
 
 @app.route('/upload_avatar', methods=['POST'], endpoint='upload_avatar_post')
+@user_transaction
 
 def upload_avatar_post():
     user_id = get_user_id()
@@ -585,14 +763,14 @@ def upload_avatar_post():
     file.save(save_path)
 
     # update user record
-    data = load_data()
+    data = load_data(user_id)
     if 'users' not in data:
         data['users'] = {}
 
     user = data['users'].get(user_id, {})
     user['avatar'] = os.path.join('avatars', filename).replace('\\', '/')
     data['users'][user_id] = user
-    save_data(data)
+    save_data(data, 'avatar_changed')
 
     return redirect(url_for('profile'))
 
@@ -603,7 +781,31 @@ if __name__ == '__main__':
 #     print(f"Firebase initialization error: {e}")
 
 DATA_FILE = 'user_data.json'
+DATABASE_FILE = 'user_data.db'
 USERS_FILE = 'users.json'
+LOCK_FILE = 'user_data.locks'
+SHARD_FOLDER = 'user_data'
+# 'json' keeps everything in DATA_FILE, 'journal' appends changes to
+# DATA_FILE.journal and snapshots into DATA_FILE, 'sqlite' uses DATABASE_FILE,
+# 'sharded' writes one file per user under SHARD_FOLDER
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+# File format of the data files: 'json' (compact), 'json-pretty' or 'binary'
+STORAGE_CODEC = os.environ.get('STORAGE_CODEC', 'json')
+SNAPSHOT_FILE = 'user_data.bin' if STORAGE_CODEC == 'binary' else DATA_FILE
+JOURNAL_COMPACT_BYTES = int(os.environ.get('JOURNAL_COMPACT_BYTES', 1024 * 1024))
+# Group commit for the 'json' backend (opt-in): saves arriving while the
+# previous snapshot write runs (plus this many ms) share one write; 'off'
+# writes on every save.  At most WRITE_COMMIT_MAX_BATCH saves are held per write.
+WRITE_COMMIT_WINDOW_MS = os.environ.get('WRITE_COMMIT_WINDOW_MS', 'off')
+WRITE_COMMIT_WINDOW = None if WRITE_COMMIT_WINDOW_MS == 'off' else float(WRITE_COMMIT_WINDOW_MS) / 1000
+WRITE_COMMIT_MAX_BATCH = int(os.environ.get('WRITE_COMMIT_MAX_BATCH', 64))
+# Password hashing runs on a process pool; logins beyond PASSWORD_HASH_MAX_PENDING
+# queued hashes are turned away with a 503.  Hashes made with another
+# PASSWORD_HASH_METHOD are upgraded when their owner logs in.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(os.cpu_count() or 1, 4)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+PASSWORD_HASH_TIMEOUT = int(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -706,6 +908,23 @@ CHALLENGE_TEMPLATES = {
     }
 }
 
+# (tag, modified) of each template catalog; a content hash, so every worker agrees
+CATALOG_VERSIONS = {
+    'quests': (catalog_tag(QUEST_TEMPLATES), datetime.now()),
+    'challenges': (catalog_tag(CHALLENGE_TEMPLATES), datetime.now()),
+}
+
+rules_engine = rules.RulesEngine(QUEST_TEMPLATES, CHALLENGE_TEMPLATES, SHOP_ITEMS)
+
+def open_store(folder='', commit_window=WRITE_COMMIT_WINDOW):
+    """Create the configured store with its files under folder"""
+    return create_store(STORAGE_BACKEND, os.path.join(folder, SNAPSHOT_FILE), os.path.join(folder, DATABASE_FILE),
+                        compact_bytes=JOURNAL_COMPACT_BYTES, shard_root=os.path.join(folder, SHARD_FOLDER),
+                        codec=STORAGE_CODEC, commit_window=commit_window, commit_max_batch=WRITE_COMMIT_MAX_BATCH)
+
+store = open_store()
+user_locks = LockStripes(LOCK_FILE)
+
 # ============ HELPER FUNCTIONS ============
 
 def load_users():
@@ -720,29 +939,252 @@ def save_users(users):
     with open(USERS_FILE, 'w') as f:
         json.dump(users, f, indent=2)
 
-def load_data():
-    """Load user data from JSON file"""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {
-        'users': {},
-        'tasks': {},
-        'achievements': {},
-        'quests': {},
-        'challenges': {},
-        'quest_templates': {},
-        'social': {},
-        'pending_challenges': {}
-    }
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING,
+                                 PASSWORD_HASH_TIMEOUT)
+
+PASSWORD_BUSY_MESSAGE = 'Too many sign-ins right now, please try again in a moment.'
+
+def upgrade_password_hash(email, password_hash, password):
+    """Re-hash a password stored with older parameters while we have it in clear"""
+    try:
+        if not password_hasher.needs_rehash(password_hash):
+            return
+        new_hash = password_hasher.hash(password)
+    except PasswordPoolBusy:
+        return  # upgraded on a later login
+    users = load_users()
+    if users.get(email, {}).get('password_hash') == password_hash:
+        users[email]['password_hash'] = new_hash
+        save_users(users)
+
+def load_data(user_id=None, sections=None):
+    """Load user data from the store (only user_id's rows when given)"""
+    return store.load(user_id, sections)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_data(data):
-    """Save user data to JSON file"""
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+def save_data(data, event=None):
+    """Save the rows of data that changed since it was loaded.
+
+    event names the mutation (task_completed, item_purchased, ...) for the
+    journal backend.
+    """
+    store.save(data, event)
+
+def user_exists(user_id):
+    """Check whether a user has a profile without loading anyone's data"""
+    return store.user_exists(user_id)
+
+def user_summaries():
+    """Leaderboard fields of every user, without loading their tasks"""
+    return store.user_summaries()
+
+# Board name -> sort key (ascending) and the rank field reported for it
+LEADERBOARD_METRICS = {
+    'by_level': lambda e: (-e['level'], -e['xp']),
+    'by_xp': lambda e: (-e['xp'],),
+    'by_coins': lambda e: (-e['coins'],),
+    'by_streak': lambda e: (-e['streak'],),
+    'by_tasks': lambda e: (-e['total_tasks_completed'],),
+}
+LEADERBOARD_RANK_FIELDS = {
+    'by_level': 'rank_level',
+    'by_xp': 'rank_xp',
+    'by_coins': 'rank_coins',
+    'by_streak': 'rank_streak',
+    'by_tasks': 'rank_tasks',
+}
+# Re-sync interval that picks up stat changes made by other worker processes
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 60))
+LEADERBOARD_PAGE_LIMIT = 100
+
+def leaderboard_entry(user_id, user):
+    """The public leaderboard stats of one user"""
+    total_earned = user.get('coins', 0) + sum(SHOP_ITEMS[item]['cost']
+                                               for item in user.get('inventory', [])
+                                               if item in SHOP_ITEMS)
+    return {
+        'id': user_id,
+        'username': user.get('username', 'Player'),
+        'level': user.get('level', 1),
+        'xp': user.get('xp', 0),
+        'coins': user.get('coins', 0),
+        'total_coins_earned': total_earned,
+        'streak': user.get('streak', 0),
+        'total_tasks_completed': user.get('total_tasks_completed', 0),
+        'badges_count': len(user.get('badges', []))
+    }
+
+def leaderboard_row(entry, user_id):
+    """An entry with its rank on every board, as returned by the API"""
+    row = dict(entry, is_current_user=entry['id'] == user_id)
+    for name, field in LEADERBOARD_RANK_FIELDS.items():
+        row[field] = leaderboards.rank(name, entry['id'])
+    return row
+
+leaderboards = Leaderboards(LEADERBOARD_METRICS, leaderboard_entry, LEADERBOARD_REFRESH_SECONDS)
+
+def leaderboard_ranks(user_id):
+    return {name: leaderboards.rank(name, user_id) for name in LEADERBOARD_METRICS}
+
+def update_leaderboards(changes):
+    """Store listener: move users whose stats were just saved and tell them if they changed rank"""
+    for section, key, text in changes:
+        if section == 'users':
+            before = leaderboard_ranks(key)
+            leaderboards.update(key, decode_row(text) if text is not None else None)
+            after = leaderboard_ranks(key)
+            if after != before and None not in after.values():
+                event_hub.publish(key, 'rank', after)
+
+store.add_listener(update_leaderboards)
+
+# Shares older than this are hidden from the feed and deleted on the next re-sync
+SOCIAL_RETENTION_DAYS = int(os.environ.get('SOCIAL_RETENTION_DAYS', 30))
+SOCIAL_FEED_PAGE_LIMIT = 100
+
+social_index = SocialFeed(LEADERBOARD_REFRESH_SECONDS)
+
+def social_retention_start():
+    return (datetime.now() - timedelta(days=SOCIAL_RETENTION_DAYS)).isoformat()
+
+def load_social_shares():
+    """All shares still inside the retention window, deleting the expired ones"""
+    data = load_data(sections=('social',))
+    shares = data.get('social', {})
+    since = social_retention_start()
+    expired = [share_id for share_id, share in shares.items() if share.get('timestamp', '') < since]
+    if expired:
+        for share_id in expired:
+            del shares[share_id]
+        try:
+            save_data(data, 'social_pruned')
+        except ConflictError:
+            pass  # another worker pruned first; the window filter still hides them
+    return dict(shares)
+
+def update_social_feed(changes):
+    """Store listener: index shares as they are posted or deleted"""
+    for section, key, text in changes:
+        if section == 'social':
+            social_index.update(key, decode_row(text) if text is not None else None)
+
+store.add_listener(update_social_feed)
+
+# Unanswered challenge invitations expire after this long
+PENDING_CHALLENGE_TTL_HOURS = int(os.environ.get('PENDING_CHALLENGE_TTL_HOURS', 72))
+EXPIRY_POLL_SECONDS = int(os.environ.get('EXPIRY_POLL_SECONDS', 60))
+EXPIRING_SECTIONS = ('challenges', 'pending_challenges')
+
+def expiry_time(section, record):
+    """When a running challenge or an open invitation runs out (None once it can't)"""
+    if section == 'challenges':
+        if record.get('completed'):
+            return None
+        return datetime.fromisoformat(record['started_at']) + timedelta(hours=record.get('duration_hours', 24))
+    if record.get('status') != 'pending':
+        return None
+    return datetime.fromisoformat(record['created_at']) + timedelta(hours=PENDING_CHALLENGE_TTL_HOURS)
+
+def expiry_entries():
+    """(expires_at, section, key) of every record that can still expire"""
+    data = load_data(sections=EXPIRING_SECTIONS)
+    entries = []
+    for section in EXPIRING_SECTIONS:
+        for key, record in data.get(section, {}).items():
+            expires_at = expiry_time(section, record)
+            if expires_at is not None:
+                entries.append((expires_at, section, key))
+    return entries
+
+def expire_records(due):
+    """Mark every due challenge and invitation expired in one save"""
+    data = load_data(sections=EXPIRING_SECTIONS)
+    now = datetime.now()
+    for section, key in due:
+        record = data[section].get(key)
+        if record is None:
+            continue
+        expires_at = expiry_time(section, record)
+        if expires_at is None or expires_at > now:
+            continue  # completed, answered or rescheduled meanwhile
+        if section == 'challenges':
+            record['completed'] = True
+            record['expired'] = True
+        else:
+            record['status'] = 'expired'
+    save_data(data, 'records_expired')
+
+expiry_scheduler = ExpiryScheduler(expire_records, expiry_entries, EXPIRY_POLL_SECONDS)
+
+def update_expiry_schedule(changes):
+    """Store listener: (re)schedule challenges and invitations as they are saved"""
+    for section, key, text in changes:
+        if section not in EXPIRING_SECTIONS:
+            continue
+        expires_at = expiry_time(section, decode_row(text)) if text is not None else None
+        if expires_at is None:
+            expiry_scheduler.cancel(section, key)
+        else:
+            expiry_scheduler.schedule(section, key, expires_at)
+
+store.add_listener(update_expiry_schedule)
+
+SSE_HEARTBEAT_SECONDS = 15
+event_hub = EventHub()
+
+def deliver_reminder(reminder):
+    event_hub.publish(reminder['user_id'], 'reminder', {
+        'task_id': reminder['task_id'],
+        'title': reminder['title'],
+        'scheduled_time': reminder['scheduled_time']
+    })
+
+reminder_index = ReminderIndex()
+# Tasks saved through other workers reach this worker's reminder index at the
+# next full re-sync, so their reminders may be up to this many seconds late
+REMINDER_RESYNC_SECONDS = int(os.environ.get('REMINDER_RESYNC_SECONDS', 300))
+reminder_ticker = ReminderTicker(reminder_index, deliver_reminder, lambda: load_data(sections=('tasks',))['tasks'],
+                                 REMINDER_RESYNC_SECONDS)
+
+def update_reminders(changes):
+    """Store listener: keep the minute buckets in step with created, edited and deleted tasks"""
+    for section, key, text in changes:
+        if section == 'tasks':
+            reminder_index.update(key, decode_row(text) if text is not None else None)
+
+store.add_listener(update_reminders)
+
+def publish_changes(changes):
+    """Store listener: push saved rows to the users they concern as typed /api/events deltas"""
+    if not event_hub.subscribers:
+        return
+    for section, key, text in changes:
+        if text is None:
+            continue
+        if section == 'users':
+            event_hub.publish(key, 'user', decode_row(text))
+        elif section == 'quests':
+            quest = decode_row(text)
+            event_hub.publish(quest.get('user_id'), 'quest', quest)
+        elif section == 'challenges':
+            challenge = decode_row(text)
+            event_hub.publish(challenge.get('user_id'), 'challenge', challenge)
+        elif section == 'pending_challenges':
+            pending = decode_row(text)
+            event_hub.publish(pending.get('to_user'), 'pending_challenge', pending)
+            if pending.get('status') != 'pending':
+                event_hub.publish(pending.get('from_user'), 'challenge_answered', pending)
+        elif section == 'social':
+            event_hub.broadcast('share', decode_row(text))
+
+store.add_listener(publish_changes)
+
+@app.before_request
+def start_background_jobs():
+    expiry_scheduler.start()
+    reminder_ticker.start()
 
 def get_user_id():
     """Get current user ID from session"""
@@ -751,9 +1193,14 @@ def get_user_id():
     return session['user_id']
 
 def initialize_user(data, user_id):
-    """Initialize user data if not exists"""
-    if user_id not in data['users']:
-        data['users'][user_id] = {
+    """Return the user's profile, creating and saving it on first use.
+
+    Older profiles are brought up to date by the schema migrations at startup,
+    so this never rewrites an existing user.
+    """
+    user = data['users'].get(user_id)
+    if user is None:
+        user = data['users'][user_id] = {
             'level': 1,
             'xp': 0,
             'coins': 0,
@@ -771,36 +1218,339 @@ def initialize_user(data, user_id):
             'completed_challenges': [],
             'theme': 'light'
         }
-        save_data(data)
-    
-    # Migrate old data structure if needed
-    user = data['users'][user_id]
-    if 'avatar_customizations' in user and 'inventory' not in user:
-        user['inventory'] = [item for item in user['avatar_customizations'] if item != 'default']
-        del user['avatar_customizations']
-        save_data(data)
-    if 'inventory' not in user:
-        user['inventory'] = []
-        save_data(data)
-    # Add new fields if they don't exist
-    if 'username' not in user:
-        user['username'] = session.get('username', 'Player')
-    if 'joined_date' not in user:
-        user['joined_date'] = datetime.now().isoformat()
-    if 'total_coins_earned' not in user:
-        user['total_coins_earned'] = user.get('coins', 0)
-    if 'active_quests' not in user:
-        user['active_quests'] = []
-    if 'completed_quests' not in user:
-        user['completed_quests'] = []
-    if 'active_challenges' not in user:
-        user['active_challenges'] = []
-    if 'completed_challenges' not in user:
-        user['completed_challenges'] = []
-    if 'theme' not in user:
-        user['theme'] = 'light'
+        save_data(data, 'user_created')
     return user
 
+def usernames_by_id():
+    """Map user ids to the usernames registered in USERS_FILE"""
+    return {account['user_id']: account.get('username', 'Player')
+            for account in load_users().values() if 'user_id' in account}
+
+# Upgrade stored data once per start instead of patching users on every request
+try:
+    run_migrations(store, usernames_by_id())
+except ConflictError:
+    pass  # another worker migrated the store at the same time
+
+@app.cli.command('import-data')
+@click.argument('path', default=DATA_FILE)
+def import_data_command(path):
+    """Copy a user_data.json (or binary snapshot) file into the configured store"""
+    document = read_snapshot(path)
+    migrate_document(document, usernames_by_id())
+    count = store.import_document(document)
+    click.echo(f'Imported {count} rows from {path} into the {STORAGE_BACKEND} store')
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Run pending schema migrations on the configured store"""
+    applied = run_migrations(store, usernames_by_id())
+    if applied:
+        click.echo(f"Applied {', '.join(applied)}; schema is now at version {SCHEMA_VERSION}")
+    else:
+        click.echo(f'Schema already at version {SCHEMA_VERSION}')
+
+@app.cli.command('export-data')
+@click.argument('path', default='user_data_export.json')
+def export_data_command(path):
+    """Write the whole store as indented JSON for debugging"""
+    document = dict(load_data())
+    write_snapshot(path, document, CODECS['json-pretty'])
+    click.echo(f'Exported {sum(len(rows) for rows in document.values())} rows to {path}')
+
+def _bench_document(users):
+    """Synthetic document with three tasks and a share per user"""
+    document = {'users': {}, 'tasks': {}, 'social': {}}
+    for n in range(users):
+        user_id = f'user-{n}'
+        document['users'][user_id] = {
+            'level': n % 20 + 1, 'xp': n % 100, 'coins': n % 500, 'streak': n % 30,
+            'last_completed_date': '2025-11-08T17:31:34.822408', 'total_tasks_completed': n % 200,
+            'badges': ['tasks_10'], 'inventory': ['mountain_boots', 'tent'], 'username': f'player{n}',
+            'joined_date': '2025-11-01T10:00:00', 'total_coins_earned': n % 700,
+            'active_quests': [], 'completed_quests': [], 'active_challenges': [],
+            'completed_challenges': [], 'theme': 'light'
+        }
+        for t in range(3):
+            task_id = f'task-{n}-{t}'
+            document['tasks'][task_id] = {
+                'id': task_id, 'user_id': user_id, 'title': 'Morning run', 'description': 'Run 5km',
+                'recurring': True, 'frequency': 'daily', 'scheduled_time': '07:30', 'xp_reward': 10,
+                'coin_reward': 5, 'completed': True, 'completed_dates': ['2025-11-06', '2025-11-07', '2025-11-08'],
+                'created_at': '2025-11-01T10:00:00', 'streak': 3
+            }
+        document['social'][f'share-{n}'] = {'id': f'share-{n}', 'user_id': user_id, 'username': f'player{n}',
+                                            'badge': 'tasks_10', 'message': 'Done!',
+                                            'timestamp': '2025-11-08T18:00:00'}
+    return document
+
+@app.cli.command('bench-codecs')
+@click.option('--users', default='1000,10000,100000', help='Comma separated dataset sizes')
+def bench_codecs_command(users):
+    """Compare snapshot load/save time and file size of every codec"""
+    import tempfile
+    import time
+    tmp = tempfile.mkdtemp()
+    click.echo(f"{'users':>8} {'codec':<12} {'save ms':>9} {'load ms':>9} {'size KB':>9}")
+    for count in (int(n) for n in users.split(',')):
+        document = _bench_document(count)
+        for name, codec in CODECS.items():
+            path = os.path.join(tmp, f'bench-{name}')
+            start = time.perf_counter()
+            write_snapshot(path, document, codec)
+            saved = time.perf_counter()
+            read_snapshot(path)
+            loaded = time.perf_counter()
+            click.echo(f'{count:>8} {name:<12} {(saved - start) * 1000:>9.1f} {(loaded - saved) * 1000:>9.1f} '
+                       f'{os.path.getsize(path) / 1024:>9.0f}')
+            os.remove(path)
+
+@app.cli.command('bench-writes')
+@click.option('--clients', default='1,8,64', help='Comma separated numbers of concurrent clients')
+@click.option('--seconds', default=2.0, help='Run time of each measurement')
+@click.option('--users', default=1000, help='Users in the synthetic document')
+def bench_writes_command(clients, seconds, users):
+    """Saves and snapshot writes per second of the json backend, with and without group commit"""
+    import tempfile
+    import time
+    import threading
+    window = WRITE_COMMIT_WINDOW or 0
+    click.echo(f"{'clients':>8} {'mode':<16} {'saves/s':>9} {'writes/s':>9} {'avg ms':>8}")
+    for count in (int(n) for n in clients.split(',')):
+        for mode, commit_window in (('write per save', None), (f'group {window * 1000:g} ms', window)):
+            path = os.path.join(tempfile.mkdtemp(), SNAPSHOT_FILE)
+            write_snapshot(path, _bench_document(users), CODECS[STORAGE_CODEC])
+            bench_store = create_store('json', path, None, codec=STORAGE_CODEC,
+                                       commit_window=commit_window, commit_max_batch=WRITE_COMMIT_MAX_BATCH)
+            stop_at = time.perf_counter() + seconds
+            saves = [0] * count
+
+            def client(n):
+                # Each client adds tasks for its own user, like concurrent completions
+                user_id = f'user-{n % users}'
+                while time.perf_counter() < stop_at:
+                    data = bench_store.load(user_id, ('tasks',))
+                    task_id = f'bench-{n}-{saves[n]}'
+                    data['tasks'][task_id] = {'id': task_id, 'user_id': user_id, 'title': task_id}
+                    bench_store.save(data)
+                    saves[n] += 1
+
+            threads = [threading.Thread(target=client, args=(n,)) for n in range(count)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            total = sum(saves)
+            # Without group commit every save is one snapshot write
+            writes = bench_store.commits if commit_window is not None else total
+            click.echo(f'{count:>8} {mode:<16} {total / elapsed:>9.0f} {writes / elapsed:>9.0f} '
+                       f'{elapsed * count * 1000 / max(total, 1):>8.2f}')
+
+@app.cli.command('bench-agenda')
+@click.option('--tasks', default=20, help='Recurring tasks of the user')
+@click.option('--days', default=365, help='Length of the expanded range')
+def bench_agenda_command(tasks, days):
+    """Time expanding a user's recurring tasks over a date range"""
+    import time
+    today = datetime.now().date()
+    created = (datetime.now() - timedelta(days=days)).isoformat()
+    data = {'tasks': {}, 'completions': {}}
+    log = completion_log(data, 'bench')
+    for i in range(tasks):
+        task_id = f'bench-{i}'
+        data['tasks'][task_id] = {'id': task_id, 'user_id': 'bench', 'title': task_id, 'recurring': True,
+                                  'frequency': 'weekly' if i % 4 == 0 else 'daily', 'created_at': created}
+        for day in range(0, days, 2):
+            record_completion(log, task_id, datetime.now() - timedelta(days=days - day))
+    log['events'].sort()
+    start = time.perf_counter()
+    entries = task_occurrences(data, 'bench', today - timedelta(days=days // 2), today + timedelta(days=days - days // 2))
+    elapsed = time.perf_counter() - start
+    click.echo(f'{len(entries)} occurrences of {tasks} tasks over {days} days in {elapsed * 1000:.1f} ms')
+
+@app.cli.command('bench-bootstrap')
+@click.option('--tasks', default=50, help='Tasks of the user')
+@click.option('--views', default=50, help='Page views per variant')
+def bench_bootstrap_command(tasks, views):
+    """Compare store reads and server time per main page view with and without /api/bootstrap"""
+    global store
+    import tempfile
+    import time
+    store = open_store(tempfile.mkdtemp())
+    user_id = 'bench-bootstrap-user'
+    data = load_data(user_id)
+    with app.test_request_context():
+        session['username'] = 'bench'
+        initialize_user(data, user_id)
+    for i in range(tasks):
+        task_id = f'bench-{i}'
+        data['tasks'][task_id] = {'id': task_id, 'user_id': user_id, 'title': task_id, 'completed_dates': []}
+    save_data(data)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['username'] = 'bench'
+    # Signed out, / renders without embedded data, like before /api/bootstrap
+    plain = app.test_client()
+    # The page itself plus what main.js fetches on load
+    variants = {
+        'separate requests': (plain, ['/api/user', '/api/tasks', '/api/settings', '/api/theme']),
+        '/api/bootstrap': (plain, ['/api/bootstrap']),
+        'embedded in page': (client, []),
+    }
+    for name, (page_client, urls) in variants.items():
+        loads = store.loads
+        start = time.perf_counter()
+        for _ in range(views):
+            page_client.get('/')
+            for url in urls:
+                client.get(url)
+        elapsed = time.perf_counter() - start
+        click.echo(f'{name}: {(store.loads - loads) / views:.0f} store reads, '
+                   f'{len(urls) + 1} requests, {elapsed * 1000 / views:.2f} ms per page view')
+
+STRESS_TASK_COINS = 10
+
+def stress_user_ids(count):
+    """count user ids, two per lock stripe, so users with nothing in common still share a lock"""
+    by_stripe, user_ids, n = {}, [], 0
+    while len(user_ids) < count:
+        user_id = f'stress-user-{n}'
+        n += 1
+        pair = by_stripe.setdefault(user_locks.stripe(user_id), [])
+        pair.append(user_id)
+        if len(pair) == 2:
+            user_ids.extend(pair)
+    return user_ids[:count]
+
+def _stress_worker(args):
+    """Play rounds as a different user each time, touching their own and shared rows.
+
+    Each round completes one of the user's tasks, buys an item, accepts the
+    invitation this worker sent the user last round, invites the next user
+    and shares to the feed (which also prunes expired shares).
+    """
+    global store, user_locks
+    from contextlib import nullcontext
+    from types import SimpleNamespace
+    worker, rounds, folder, user_ids, locks = args
+    # Reopen the store so forked workers don't share sqlite connections
+    store = open_store(folder)
+    if not locks:
+        # Leave lost updates to the optimistic row checks alone
+        user_locks = SimpleNamespace(hold=lambda key: nullcontext())
+    client = app.test_client()
+    done = {'completed': [], 'bought': [], 'invited': [], 'accepted': [], 'shared': []}
+    items = list(SHOP_ITEMS)
+    invitation = None
+    for i in range(rounds):
+        user_id = user_ids[(worker + i) % len(user_ids)]
+        friend_id = user_ids[(worker + i + 1) % len(user_ids)]
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+            sess['username'] = user_id
+        if client.post(f'/api/tasks/stress-{worker}-{i}/complete').status_code == 200:
+            done['completed'].append(user_id)
+        item = items[(worker + i) % len(items)]
+        if client.post('/api/user/unlock', json={'item': item}).status_code == 200:
+            done['bought'].append((user_id, item))
+        if invitation is not None:
+            resp = client.post(f'/api/pending-challenges/{invitation}/respond', json={'accept': True})
+            if resp.status_code == 200:
+                done['accepted'].append((user_id, invitation))
+        resp = client.post('/api/challenge-friend', json={'friend_id': friend_id, 'template_id': 'daily_grind'})
+        invitation = resp.get_json()['pending']['id'] if resp.status_code == 200 else None
+        if invitation is not None:
+            done['invited'].append(invitation)
+        resp = client.post('/api/share-achievement', json={'badge': 'stress', 'message': f'round {i}'})
+        if resp.status_code == 200:
+            done['shared'].append(resp.get_json()['share']['id'])
+        client.get('/api/social-feed?limit=5')
+    done['conflicts'] = save_conflicts
+    return done
+
+def stress_problems(data, user_ids, done):
+    """Everything in the store that disagrees with the requests that succeeded"""
+    problems = []
+    for user_id in user_ids:
+        user = data['users'][user_id]
+        completed = done['completed'].count(user_id)
+        bought = [item for owner, item in done['bought'] if owner == user_id]
+        accepted = [pending_id for owner, pending_id in done['accepted'] if owner == user_id]
+        challenges = [c for c in data['challenges'].values() if c.get('user_id') == user_id]
+        # Tasks give coins only; challenge rewards (and the level-ups their XP causes) add the rest
+        expected_coins = (completed * STRESS_TASK_COINS
+                          + sum(c['coin_reward'] for c in challenges if c.get('completed') and not c.get('expired'))
+                          + 50 * (user['level'] - 1)
+                          - sum(SHOP_ITEMS[item]['cost'] for item in bought))
+        if user['total_tasks_completed'] != completed:
+            problems.append(f"{user_id}: total_tasks_completed is {user['total_tasks_completed']}, expected {completed}")
+        if user['coins'] != expected_coins:
+            problems.append(f"{user_id}: coins are {user['coins']}, expected {expected_coins}")
+        if sorted(user['inventory']) != sorted(bought) or len(set(bought)) != len(bought):
+            problems.append(f"{user_id}: inventory {sorted(user['inventory'])} does not match purchases {sorted(bought)}")
+        if len(challenges) != len(accepted):
+            problems.append(f'{user_id}: {len(challenges)} challenges for {len(accepted)} accepted invitations')
+    accepted = {pending_id for _, pending_id in done['accepted']}
+    for pending_id in done['invited']:
+        status = data['pending_challenges'].get(pending_id, {}).get('status')
+        if status != ('accepted' if pending_id in accepted else 'pending'):
+            problems.append(f'invitation {pending_id} is {status}')
+    missing = [share_id for share_id in done['shared'] if share_id not in data['social']]
+    if missing:
+        problems.append(f'{len(missing)} shares missing from the feed')
+    return problems
+
+@app.cli.command('stress-test')
+@click.option('--processes', default=8, help='Concurrent worker processes')
+@click.option('--users', default=6, help='Users the workers take turns acting as (two per lock stripe)')
+@click.option('--rounds', default=25, help='Rounds per worker')
+@click.option('--locks/--no-locks', default=True, help='Hold the per-user lock stripes (off: only the row checks)')
+def stress_test_command(processes, users, rounds, locks):
+    """Hammer task, shop, invitation and feed handlers from many processes and check no update is lost"""
+    global store, user_locks
+    import multiprocessing
+    import tempfile
+    tmp = tempfile.mkdtemp()
+    store = open_store(tmp)
+    user_locks = LockStripes(os.path.join(tmp, LOCK_FILE))
+    user_ids = stress_user_ids(users)
+
+    # Tasks give coins but no XP so their level-ups don't blur the totals
+    data = load_data()
+    for user_id in user_ids:
+        with app.test_request_context():
+            session['username'] = user_id
+            initialize_user(data, user_id)
+    for worker in range(processes):
+        for i in range(rounds):
+            task_id = f'stress-{worker}-{i}'
+            data['tasks'][task_id] = {'id': task_id, 'user_id': user_ids[(worker + i) % len(user_ids)],
+                                      'title': task_id, 'xp_reward': 0, 'coin_reward': STRESS_TASK_COINS,
+                                      'completed_dates': []}
+    # Expired shares that every worker's first feed read races to delete
+    old = (datetime.now() - timedelta(days=SOCIAL_RETENTION_DAYS + 1)).isoformat()
+    for n in range(20):
+        data['social'][f'stress-old-{n}'] = {'id': f'stress-old-{n}', 'user_id': user_ids[0], 'badge': 'old',
+                                             'message': '', 'timestamp': old}
+    save_data(data)
+
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.map(_stress_worker, [(worker, rounds, tmp, user_ids, locks) for worker in range(processes)])
+
+    done = {key: [entry for result in results for entry in result[key]]
+            for key in ('completed', 'bought', 'invited', 'accepted', 'shared')}
+    problems = stress_problems(load_data(), user_ids, done)
+    click.echo(f"{processes} processes, {len(user_ids)} users: {len(done['completed'])} completions, "
+               f"{len(done['bought'])} purchases, {len(done['accepted'])} accepted invitations, "
+               f"{len(done['shared'])} shares, {sum(result['conflicts'] for result in results)} conflict retries")
+    if problems:
+        raise click.ClickException('Lost updates: ' + '; '.join(problems))
+    click.echo('No lost updates')
+
 def login_required(f):
     """Decorator to require login for routes"""
     @wraps(f)
@@ -815,7 +1565,10 @@ def login_required(f):
 @app.route('/')
 
 def index():
-    return render_template('index.html')
+    # Embed what main.js would otherwise fetch from /api/bootstrap
+    user_id = get_user_id()
+    bootstrap = bootstrap_payload(load_data(user_id, BOOTSTRAP_SECTIONS), user_id) if user_id else None
+    return render_template('index.html', bootstrap=bootstrap)
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
@@ -835,8 +1588,13 @@ def login():
         
         # Verify password
         user_data = users[email]
-        if not check_password_hash(user_data['password_hash'], password):
+        try:
+            valid = password_hasher.verify(user_data['password_hash'], password)
+        except PasswordPoolBusy:
+            return render_template("login.html", error=PASSWORD_BUSY_MESSAGE), 503
+        if not valid:
             return render_template("login.html", error="Invalid email or password.")
+        upgrade_password_hash(email, user_data['password_hash'], password)
         
         # Set session
         session.permanent = True
@@ -845,7 +1603,7 @@ def login():
         session['user_id'] = user_data['user_id']
         
         # Initialize user data
-        data = load_data()
+        data = load_data(user_data['user_id'])
         initialize_user(data, user_data['user_id'])
         
         return redirect(url_for('index'))
@@ -876,6 +1634,11 @@ def register():
         if email in users:
             return render_template("register.html", error="Email already exists. Please login instead.")
         
+        try:
+            password_hash = password_hasher.hash(password)
+        except PasswordPoolBusy:
+            return render_template("register.html", error=PASSWORD_BUSY_MESSAGE), 503
+        
         # Create new user
         user_id = str(uuid.uuid4())
         username = email.split('@')[0]
@@ -883,7 +1646,7 @@ def register():
         users[email] = {
             'user_id': user_id,
             'username': username,
-            'password_hash': generate_password_hash(password),
+            'password_hash': password_hash,
             'email': email,
             'created_at': datetime.now().isoformat()
         }
@@ -892,7 +1655,7 @@ def register():
         save_users(users)
         
         # Initialize user data
-        data = load_data()
+        data = load_data(user_id)
         session['user_id'] = user_id
         session['username'] = username
         initialize_user(data, user_id)
@@ -932,7 +1695,7 @@ def auth_firebase():
         session['firebase_uid'] = uid
         
         # Initialize user data
-        user_data_store = load_data()
+        user_data_store = load_data(uid)
         initialize_user(user_data_store, uid)
         
         return jsonify({'success': True, 'message': 'Authenticated successfully'})
@@ -965,10 +1728,10 @@ def auth_google():
         session['firebase_uid'] = uid
         
         # Initialize user data
-        user_data_store = load_data()
+        user_data_store = load_data(uid)
         user = initialize_user(user_data_store, uid)
         user['username'] = name
-        save_data(user_data_store)
+        save_data(user_data_store, 'profile_updated')
         
         return jsonify({'success': True, 'message': 'Authenticated successfully'})
         
@@ -979,31 +1742,35 @@ def auth_google():
 # ============ TASK ROUTES ============
 
 @app.route('/api/tasks', methods=['GET'])
+@conditional_get(user_data_version)
 
 def get_tasks():
-    """Get all tasks for current user"""
-    data = load_data()
+    """Get all tasks for current user, or with ?since=<version> only what changed after it"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'since must be a version number'}), 400
+    data = load_data(user_id)
         
     initialize_user(data, user_id)
+    version = task_sync(data, user_id)['version']
+    
+    if since is not None:
+        changed, deleted, full = changes_since(data, user_id, since)
+        return jsonify({'tasks': changed, 'deleted': deleted, 'full': full, 'version': version})
     
     user_tasks = [task for task in data['tasks'].values() if task.get('user_id') == user_id]
-    return jsonify({'tasks': user_tasks})
+    return jsonify({'tasks': user_tasks, 'version': version})
 
-@app.route('/api/tasks', methods=['POST'])
-
-def create_task():
-    """Create a new task"""
-    data = load_data()
-    user_id = get_user_id()
-    if not user_id:
-        return jsonify({'error': 'Unauthorized'}), 401
-        
+def apply_create_task(data, user_id, task_data):
+    """Add a task to data; returns (response body, status) like the routes do"""
     user = initialize_user(data, user_id)
     
-    task_data = request.json
     task_id = str(uuid.uuid4())
     # respect user defaults if client doesn't provide rewards
     xp_reward = task_data.get('xp_reward') if task_data.get('xp_reward') is not None else user.get('default_xp_reward', 10)
@@ -1025,78 +1792,123 @@ def create_task():
         'streak': 0
     }
     
+    touch_task(data, user_id, new_task)
     data['tasks'][task_id] = new_task
-    save_data(data)
-    
-    return jsonify({'task': new_task, 'message': 'Task created successfully!'})
+    return {'task': new_task, 'message': 'Task created successfully!'}, 200
 
-@app.route('/api/tasks/<task_id>', methods=['PUT'])
+@app.route('/api/tasks', methods=['POST'])
+@user_transaction
 
-def update_task(task_id):
-    """Update a task"""
-    data = load_data()
+def create_task():
+    """Create a new task"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
     
+    body, status = apply_create_task(data, user_id, request.json)
+    save_data(data, 'task_created')
+    return jsonify(body), status
+
+def apply_update_task(data, user_id, task_id, task_data):
     if task_id not in data['tasks'] or data['tasks'][task_id].get('user_id') != user_id:
-        return jsonify({'error': 'Task not found'}), 404
+        return {'error': 'Task not found'}, 404
     
-    task_data = request.json
     task = data['tasks'][task_id]
     
     # Update task fields
     for key in ['title', 'description', 'recurring', 'frequency', 'scheduled_time']:
         if key in task_data:
             task[key] = task_data[key]
+    touch_task(data, user_id, task)
     
-    save_data(data)
-    return jsonify({'task': task, 'message': 'Task updated successfully!'})
+    return {'task': task, 'message': 'Task updated successfully!'}, 200
 
-@app.route('/api/tasks/<task_id>', methods=['DELETE'])
+@app.route('/api/tasks/<task_id>', methods=['PUT'])
+@user_transaction
 
-def delete_task(task_id):
-    """Delete a task"""
-    data = load_data()
+def update_task(task_id):
+    """Update a task"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
     
+    body, status = apply_update_task(data, user_id, task_id, request.json)
+    if status == 200:
+        save_data(data, 'task_updated')
+    return jsonify(body), status
+
+def apply_delete_task(data, user_id, task_id):
     if task_id not in data['tasks'] or data['tasks'][task_id].get('user_id') != user_id:
-        return jsonify({'error': 'Task not found'}), 404
+        return {'error': 'Task not found'}, 404
     
     del data['tasks'][task_id]
-    save_data(data)
-    return jsonify({'message': 'Task deleted successfully!'})
+    tombstone(data, user_id, task_id)
+    return {'message': 'Task deleted successfully!'}, 200
 
-@app.route('/api/tasks/<task_id>/complete', methods=['POST'])
+@app.route('/api/tasks/<task_id>', methods=['DELETE'])
+@user_transaction
 
-def complete_task(task_id):
-    """Mark task as completed and award rewards"""
-    data = load_data()
+def delete_task(task_id):
+    """Delete a task"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
-        
-    user = initialize_user(data, user_id)
+    data = load_data(user_id)
     
+    body, status = apply_delete_task(data, user_id, task_id)
+    if status == 200:
+        save_data(data, 'task_deleted')
+    return jsonify(body), status
+
+def task_completion_error(data, user_id, task_id, today):
+    """(error, status) if task_id can't be completed today, else None"""
     if task_id not in data['tasks'] or data['tasks'][task_id].get('user_id') != user_id:
-        return jsonify({'error': 'Task not found'}), 404
+        return 'Task not found', 404
     
-    task = data['tasks'][task_id]
+    # Check if already completed today
+    if today in data['tasks'][task_id].get('completed_dates', []):
+        return 'Task already completed today', 400
+    return None
+
+# badge -> (user counter, threshold, message)
+COMPLETION_BADGES = {
+    'streak_7': ('streak', 7, '7 Day Streak!'),
+    'streak_30': ('streak', 30, '30 Day Streak!'),
+    'tasks_10': ('total_tasks_completed', 10, '10 Tasks Completed!'),
+    'tasks_50': ('total_tasks_completed', 50, '50 Tasks Completed!'),
+}
+
+def apply_complete_tasks(data, user_id, task_ids):
+    """Complete several tasks at once and award their rewards together.
+
+    Streak, level-ups, quests and badges are worked out once over the summed
+    XP and coins.  Returns (response body, status); ids that can't be
+    completed are listed under 'errors' and change nothing.
+    """
+    user = initialize_user(data, user_id)
     today = datetime.now().date().isoformat()
     
-    # Check if already completed today
-    if today in task.get('completed_dates', []):
-        return jsonify({'error': 'Task already completed today'}), 400
+    tasks, errors = [], {}
+    for task_id in dict.fromkeys(task_ids):
+        error = task_completion_error(data, user_id, task_id, today)
+        if error:
+            errors[task_id] = error[0]
+        else:
+            tasks.append(data['tasks'][task_id])
+    if not tasks:
+        return {'completed': [], 'errors': errors, 'user': user}, 200
     
     # Award rewards
-    xp_reward = task.get('xp_reward', 10)
-    coin_reward = task.get('coin_reward', 5)
+    xp_reward = sum(task.get('xp_reward', 10) for task in tasks)
+    coin_reward = sum(task.get('coin_reward', 5) for task in tasks)
     
+    level_before = user['level']
+    counters_before = {field: user.get(field, 0) for field in ('streak', 'total_tasks_completed')}
     user['xp'] += xp_reward
     user['coins'] += coin_reward
-    user['total_tasks_completed'] += 1
+    user['total_tasks_completed'] += len(tasks)
     
     # Update streak
     last_date = user.get('last_completed_date')
@@ -1106,102 +1918,311 @@ def complete_task(task_id):
         
         if (today_obj - last_date_obj).days == 1:
             user['streak'] += 1
-            task['streak'] = task.get('streak', 0) + 1
+            for task in tasks:
+                task['streak'] = task.get('streak', 0) + 1
         elif (today_obj - last_date_obj).days > 1:
             user['streak'] = 1
-            task['streak'] = 1
+            for task in tasks:
+                task['streak'] = 1
     else:
         user['streak'] = 1
-        task['streak'] = 1
+        for task in tasks:
+            task['streak'] = 1
     
     user['last_completed_date'] = datetime.now().isoformat()
     
-    # Update task
-    if 'completed_dates' not in task:
-        task['completed_dates'] = []
-    task['completed_dates'].append(today)
-    task['completed'] = True
+    # Update tasks
+    completed_at = datetime.now()
+    log = completion_log(data, user_id)
+    for task in tasks:
+        if 'completed_dates' not in task:
+            task['completed_dates'] = []
+        task['completed_dates'].append(today)
+        task['completed'] = True
+        touch_task(data, user_id, task)
+        record_completion(log, task['id'], completed_at)
     
     # Level up check
     xp_for_next_level = user['level'] * 100
-    level_up = False
     while user['xp'] >= xp_for_next_level:
         user['level'] += 1
         user['xp'] -= xp_for_next_level
         xp_for_next_level = user['level'] * 100
-        level_up = True
         user['coins'] += 50
     
-    # Check for achievements
-    achievements_unlocked = []
-    
-    # Streak achievements
-    if user['streak'] == 7 and 'streak_7' not in user['badges']:
-        user['badges'].append('streak_7')
-        achievements_unlocked.append('7 Day Streak!')
-    if user['streak'] == 30 and 'streak_30' not in user['badges']:
-        user['badges'].append('streak_30')
-        achievements_unlocked.append('30 Day Streak!')
-    
-    # Task completion achievements
-    if user['total_tasks_completed'] == 10 and 'tasks_10' not in user['badges']:
-        user['badges'].append('tasks_10')
-        achievements_unlocked.append('10 Tasks Completed!')
-    if user['total_tasks_completed'] == 50 and 'tasks_50' not in user['badges']:
-        user['badges'].append('tasks_50')
-        achievements_unlocked.append('50 Tasks Completed!')
+    # Advance active quests and challenges (their rewards may level up again)
+    events = [rules.task_completed(task['id'], completed_at) for task in tasks]
+    events.append(rules.coins_earned(coin_reward + 50 * (user['level'] - level_before)))
+    events += [rules.level_up(level) for level in range(level_before + 1, user['level'] + 1)]
+    quests_completed, challenges_completed = rules_engine.process(data, user_id, events)
     
-    save_data(data)
+    # Check for achievements: badges whose threshold this completion crossed
+    achievements_unlocked = []
+    for badge, (field, threshold, message) in COMPLETION_BADGES.items():
+        if counters_before[field] < threshold <= user[field] and badge not in user['badges']:
+            user['badges'].append(badge)
+            achievements_unlocked.append(message)
     
-    return jsonify({
-        'message': 'Task completed!',
+    return {
+        'message': 'Task completed!' if len(tasks) == 1 else f'{len(tasks)} tasks completed!',
+        'completed': [task['id'] for task in tasks],
+        'errors': errors,
         'xp_reward': xp_reward,
         'coin_reward': coin_reward,
         'user': user,
-        'level_up': level_up,
-        'achievements': achievements_unlocked
-    })
-
-# ============ USER ROUTES ============
+        'level_up': user['level'] > level_before,
+        'achievements': achievements_unlocked,
+        'quests_completed': quests_completed,
+        'challenges_completed': challenges_completed
+    }, 200
+
+def apply_complete_task(data, user_id, task_id):
+    """Complete a task in data and award its rewards; returns (response body, status)"""
+    error = task_completion_error(data, user_id, task_id, datetime.now().date().isoformat())
+    if error:
+        return {'error': error[0]}, error[1]
+    body, status = apply_complete_tasks(data, user_id, [task_id])
+    del body['completed'], body['errors']
+    return body, status
 
-@app.route('/api/user', methods=['GET'])
+@app.route('/api/tasks/<task_id>/complete', methods=['POST'])
+@user_transaction
 
-def get_user():
-    """Get current user data"""
-    data = load_data()
+def complete_task(task_id):
+    """Mark task as completed and award rewards"""
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
-        
-    user = initialize_user(data, user_id)
+    data = load_data(user_id)
     
+    body, status = apply_complete_task(data, user_id, task_id)
+    if status == 200:
+        save_data(data, 'task_completed')
+    return jsonify(body), status
+
+BULK_MAX_TASKS = 1000
+
+def bulk_list(payload, field):
+    """payload[field] if it is a list the bulk endpoints accept, else None"""
+    items = payload.get(field) if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items or len(items) > BULK_MAX_TASKS:
+        return None
+    return items
+
+@app.route('/api/tasks/bulk', methods=['POST'])
+@user_transaction
+
+def bulk_create_tasks():
+    """Create many tasks (e.g. an import) with a single save"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    task_list = bulk_list(request.get_json(silent=True), 'tasks')
+    if task_list is None or not all(isinstance(task_data, dict) for task_data in task_list):
+        return jsonify({'error': f'tasks must be a list of 1 to {BULK_MAX_TASKS} task objects'}), 400
+    data = load_data(user_id)
+
+    created = [apply_create_task(data, user_id, task_data)[0]['task'] for task_data in task_list]
+    save_data(data, 'tasks_created')
+    return jsonify({'tasks': created, 'message': f'{len(created)} tasks created!'})
+
+@app.route('/api/tasks/bulk/complete', methods=['POST'])
+@user_transaction
+
+def bulk_complete_tasks():
+    """Complete a set of tasks for today, awarding their rewards together"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    task_ids = bulk_list(request.get_json(silent=True), 'task_ids')
+    if task_ids is None or not all(isinstance(task_id, str) for task_id in task_ids):
+        return jsonify({'error': f'task_ids must be a list of 1 to {BULK_MAX_TASKS} ids'}), 400
+    data = load_data(user_id)
+
+    body, status = apply_complete_tasks(data, user_id, task_ids)
+    if body['completed']:
+        save_data(data, 'tasks_completed')
+    return jsonify(body), status
+
+@app.route('/api/tasks/bulk/delete', methods=['POST'])
+@user_transaction
+
+def bulk_delete_tasks():
+    """Delete many tasks with a single save"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    task_ids = bulk_list(request.get_json(silent=True), 'task_ids')
+    if task_ids is None or not all(isinstance(task_id, str) for task_id in task_ids):
+        return jsonify({'error': f'task_ids must be a list of 1 to {BULK_MAX_TASKS} ids'}), 400
+    data = load_data(user_id)
+
+    deleted, not_found = [], []
+    for task_id in dict.fromkeys(task_ids):
+        status = apply_delete_task(data, user_id, task_id)[1]
+        (deleted if status == 200 else not_found).append(task_id)
+    if deleted:
+        save_data(data, 'tasks_deleted')
+    return jsonify({'deleted': deleted, 'not_found': not_found,
+                    'message': f'{len(deleted)} tasks deleted!'})
+
+BATCH_MAX_OPERATIONS = 100
+
+# op -> apply(data, user_id, operation), with operation['task_id'] already resolved
+BATCH_OPERATIONS = {
+    'create_task': lambda data, user_id, op: apply_create_task(data, user_id, op.get('task') or {}),
+    'update_task': lambda data, user_id, op: apply_update_task(data, user_id, op.get('task_id'), op.get('task') or {}),
+    'complete_task': lambda data, user_id, op: apply_complete_task(data, user_id, op.get('task_id')),
+    'delete_task': lambda data, user_id, op: apply_delete_task(data, user_id, op.get('task_id')),
+    'unlock': lambda data, user_id, op: apply_unlock(data, user_id, op.get('item')),
+    'check_quest': lambda data, user_id, op: apply_check_quest(data, user_id, op.get('quest_id')),
+}
+
+# Fields an operation may carry (null or left out is fine) and the type they must have
+BATCH_FIELDS = {'task_id': str, 'item': str, 'quest_id': str, 'task': dict}
+
+def batch_operation_error(operation):
+    """Why operation can't be run, or None if it is well formed"""
+    if not isinstance(operation, dict):
+        return 'operation must be an object'
+    name = operation.get('op')
+    if not isinstance(name, str) or name not in BATCH_OPERATIONS:
+        return f'Unknown operation: {name}'
+    for field, kind in BATCH_FIELDS.items():
+        if operation.get(field) is not None and not isinstance(operation[field], kind):
+            return f'{field} must be {"an object" if kind is dict else "a string"}'
+    return None
+
+def resolve_batch_task_id(task_id, results):
+    """'$N' refers to the task created by operation N of the same batch"""
+    if not isinstance(task_id, str) or not task_id.startswith('$'):
+        return task_id
+    index = task_id[1:]
+    if not index.isdecimal() or int(index) >= len(results):
+        return None
+    created = results[int(index)]
+    return created.get('task', {}).get('id') if created['op'] == 'create_task' else None
+
+@app.route('/api/batch', methods=['POST'])
+@user_transaction
+
+def run_batch():
+    """Apply a list of task operations in order with a single load and save.
+
+    Body: {"operations": [{"op": "create_task", "task": {...}},
+    {"op": "complete_task", "task_id": "$0"}, ...], "atomic": false}.
+    Each operation gets its own result; failed ones change nothing.  With
+    "atomic": true nothing is saved unless every operation succeeds.
+    """
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+    for index, operation in enumerate(operations):
+        error = batch_operation_error(operation)
+        if error:
+            return jsonify({'error': f'Operation {index}: {error}'}), 400
+    atomic = bool(payload.get('atomic'))
+
+    data = load_data(user_id)
+    results = []
+    failed = False
+    for operation in operations:
+        name = operation['op']
+        operation = dict(operation, task_id=resolve_batch_task_id(operation.get('task_id'), results))
+        body, status = BATCH_OPERATIONS[name](data, user_id, operation)
+        # Later operations may change the same task; keep each result as it was
+        results.append(dict(copy.deepcopy(body), op=name, status=status))
+        failed = failed or status != 200
+
+    if atomic and failed:
+        return jsonify({'results': results, 'committed': False}), 400
+    save_data(data, 'batch')
+    return jsonify({'results': results, 'committed': True})
+
+# ============ USER ROUTES ============
+
+def user_stats(user):
+    """The /api/user payload: the profile plus progress towards the next level"""
     # Calculate XP needed for next level
     xp_needed = user['level'] * 100
     xp_progress = user['xp'] % xp_needed if user['level'] > 1 else user['xp']
     xp_percentage = (xp_progress / xp_needed) * 100
     
-    return jsonify({
+    return {
         'user': user,
         'xp_needed': xp_needed,
         'xp_progress': xp_progress,
         'xp_percentage': xp_percentage
-    })
+    }
+
+def user_settings(user):
+    return {
+        'default_xp_reward': user.get('default_xp_reward', 10),
+        'default_coin_reward': user.get('default_coin_reward', 5),
+        'notifications_enabled': user.get('notifications_enabled', True),
+        'avatar_url': user.get('avatar_url', session.get('avatar'))
+    }
+
+def user_theme(user):
+    return user.get('theme') or session.get('theme', 'light')
+
+# Everything the main page needs lives in these sections
+BOOTSTRAP_SECTIONS = ('users', 'tasks', 'task_sync')
+
+def bootstrap_payload(data, user_id):
+    """What /api/user, /api/tasks, /api/settings and /api/theme return, from one load"""
+    user = initialize_user(data, user_id)
+    return {
+        **user_stats(user),
+        'tasks': [task for task in data['tasks'].values() if task.get('user_id') == user_id],
+        'tasks_version': task_sync(data, user_id)['version'],
+        'settings': user_settings(user),
+        'theme': user_theme(user)
+    }
+
+@app.route('/api/bootstrap', methods=['GET'])
+
+def get_bootstrap():
+    """Get the user, tasks, settings and theme for the main page in one request"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(bootstrap_payload(load_data(user_id, BOOTSTRAP_SECTIONS), user_id))
+
+@app.route('/api/user', methods=['GET'])
+@conditional_get(user_data_version)
+
+def get_user():
+    """Get current user data"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
+        
+    user = initialize_user(data, user_id)
+    return jsonify(user_stats(user))
 
 @app.route('/api/theme', methods=['GET', 'POST'])
+@user_transaction
 
 def theme_api():
     """Get or set theme preference"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     initialize_user(data, user_id)
 
     if request.method == 'GET':
-        user = data['users'].get(user_id, {})
-        theme = user.get('theme') or session.get('theme', 'light')
-        return jsonify({'theme': theme})
+        return jsonify({'theme': user_theme(data['users'].get(user_id, {}))})
 
     # POST: set theme
     payload = request.json or {}
@@ -1212,30 +2233,25 @@ def theme_api():
     # persist
     if user_id in data.get('users', {}):
         data['users'][user_id]['theme'] = theme
-        save_data(data)
+        save_data(data, 'theme_changed')
 
     session['theme'] = theme
     return jsonify({'message': 'Theme updated', 'theme': theme})
 
 @app.route('/api/settings', methods=['GET', 'POST'])
+@user_transaction
 
 def settings_api():
     """Get or update user settings"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     user = initialize_user(data, user_id)
 
     if request.method == 'GET':
-        settings = {
-            'default_xp_reward': user.get('default_xp_reward', 10),
-            'default_coin_reward': user.get('default_coin_reward', 5),
-            'notifications_enabled': user.get('notifications_enabled', True),
-            'avatar_url': user.get('avatar_url', session.get('avatar'))
-        }
-        return jsonify({'settings': settings})
+        return jsonify({'settings': user_settings(user)})
 
     # POST: update settings
     payload = request.json or {}
@@ -1247,7 +2263,7 @@ def settings_api():
         if 'notifications_enabled' in payload:
             user['notifications_enabled'] = bool(payload.get('notifications_enabled'))
 
-        save_data(data)
+        save_data(data, 'settings_changed')
         return jsonify({'message': 'Settings updated', 'settings': {
             'default_xp_reward': user.get('default_xp_reward'),
             'default_coin_reward': user.get('default_coin_reward'),
@@ -1258,6 +2274,7 @@ def settings_api():
         return jsonify({'error': 'Invalid settings payload'}), 400
 
 @app.route('/api/user/avatar', methods=['POST'])
+@user_transaction
 
 def upload_avatar():
     """Upload avatar image for current user"""
@@ -1277,32 +2294,21 @@ def upload_avatar():
         filepath = os.path.join(UPLOAD_FOLDER, filename)
         file.save(filepath)
 
-        data = load_data()
+        data = load_data(user_id)
         user = initialize_user(data, user_id)
         user['avatar_url'] = url_for('static', filename=f'uploads/{filename}')
-        save_data(data)
+        save_data(data, 'avatar_changed')
 
         return jsonify({'message': 'Avatar uploaded', 'avatar_url': user['avatar_url']})
 
     return jsonify({'error': 'Invalid file type'}), 400
 
-@app.route('/api/user/unlock', methods=['POST'])
-
-def unlock_customization():
-    """Unlock avatar/item customization"""
-    data = load_data()
-    user_id = get_user_id()
-    if not user_id:
-        return jsonify({'error': 'Unauthorized'}), 401
-        
+def apply_unlock(data, user_id, item_id):
     user = initialize_user(data, user_id)
     
-    item_data = request.json
-    item_id = item_data.get('item')
-    
     # Validate item exists
     if item_id not in SHOP_ITEMS:
-        return jsonify({'error': 'Invalid item'}), 400
+        return {'error': 'Invalid item'}, 400
         
     item = SHOP_ITEMS[item_id]
     
@@ -1312,43 +2318,62 @@ def unlock_customization():
     
     # Check if already owned
     if item_id in user.get('inventory', []):
-        return jsonify({'error': 'Item already unlocked'}), 400
+        return {'error': 'Item already unlocked'}, 400
     
     # Check if enough coins
     if user['coins'] < item['cost']:
-        return jsonify({'error': 'Not enough coins'}), 400
+        return {'error': 'Not enough coins'}, 400
     
     # Purchase the item
     user['coins'] -= item['cost']
     user['inventory'].append(item_id)
+    quests_completed, challenges_completed = rules_engine.process(data, user_id, [rules.item_purchased(item_id)])
     
-    save_data(data)
-    return jsonify({
+    return {
         'message': f'Successfully purchased {item["name"]}!',
         'user': user,
         'item': {
             'id': item_id,
             'name': item['name'],
             'cost': item['cost']
-        }
-    })
+        },
+        'quests_completed': quests_completed,
+        'challenges_completed': challenges_completed
+    }, 200
+
+@app.route('/api/user/unlock', methods=['POST'])
+@user_transaction
+
+def unlock_customization():
+    """Unlock avatar/item customization"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
+    
+    body, status = apply_unlock(data, user_id, request.json.get('item'))
+    if status == 200:
+        save_data(data, 'item_purchased')
+    return jsonify(body), status
 
 # ============ QUESTS ENDPOINTS ============
 
 @app.route('/api/quest-templates', methods=['GET'])
+@conditional_get(quest_catalog_version)
 
 def get_quest_templates():
     """Get available quest templates"""
     return jsonify({'templates': QUEST_TEMPLATES})
 
 @app.route('/api/quests', methods=['GET'])
+@conditional_get(user_data_version, quest_catalog_version)
 
 def get_quests():
     """Get all quests for current user"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     user = initialize_user(data, user_id)
     
@@ -1377,13 +2402,14 @@ def get_quests():
     })
 
 @app.route('/api/quests', methods=['POST'])
+@user_transaction
 
 def create_quest():
     """Start a new quest from template"""
-    data = load_data()
     user_id = get_user_id()
     if not user_id:
         return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
         
     user = initialize_user(data, user_id)
     
@@ -1410,6 +2436,7 @@ def create_quest():
         'metadata': {k: v for k, v in template.items() if k not in ['name', 'description', 'xp_reward', 'coin_reward']}
     }
     
+    rules_engine.seed_quest(new_quest, user, data)
     data['quests'][quest_id] = new_quest
     
     # Track user quests
@@ -1420,116 +2447,57 @@ def create_quest():
     
     data['active_quests'][user_id].append(quest_id)
     
-    save_data(data)
+    save_data(data, 'quest_started')
     
     return jsonify({
         'quest': new_quest,
         'message': f'Started quest: {template["name"]}'
     })
 
-@app.route('/api/quests/<quest_id>/check', methods=['POST'])
-
-def check_quest_progress(quest_id):
-    """Check if quest objective is met and complete if so"""
-    data = load_data()
-    user_id = get_user_id()
-    if not user_id:
-        return jsonify({'error': 'Unauthorized'}), 401
-        
+def apply_check_quest(data, user_id, quest_id):
     user = initialize_user(data, user_id)
     
     if quest_id not in data['quests'] or data['quests'][quest_id].get('user_id') != user_id:
-        return jsonify({'error': 'Quest not found'}), 404
+        return {'error': 'Quest not found'}, 404
     
     quest = data['quests'][quest_id]
     
     if quest['completed']:
-        return jsonify({'error': 'Quest already completed'}), 400
+        return {'error': 'Quest already completed'}, 400
     
-    # Check progress based on template
-    template_id = quest['template_id']
-    template = QUEST_TEMPLATES[template_id]
-    progress = 0
-    completed = False
-    
-    if template_id == 'early_bird':
-        # Count tasks completed today before 9 AM
-        today = datetime.now().date().isoformat()
-        morning_tasks = sum(1 for task in data['tasks'].values() 
-                           if task.get('user_id') == user_id 
-                           and today in task.get('completed_dates', [])
-                           and task.get('scheduled_time', '') < '09:00')
-        progress = min(morning_tasks, template['tasks_required'])
-        completed = morning_tasks >= template['tasks_required']
-    
-    elif template_id == 'streak_master':
-        progress = user['streak']
-        completed = user['streak'] >= template['streak_required']
-    
-    elif template_id == 'coin_collector':
-        # Total coins earned (current + spent on items)
-        total_earned = user['coins'] + sum(SHOP_ITEMS[item]['cost'] 
-                                          for item in user.get('inventory', []) 
-                                          if item in SHOP_ITEMS)
-        progress = total_earned
-        completed = total_earned >= template['coins_required']
-    
-    elif template_id == 'level_up':
-        progress = user['level']
-        completed = user['level'] >= template['level_required']
-    
-    elif template_id == 'shopping_spree':
-        progress = len(user.get('inventory', []))
-        completed = len(user.get('inventory', [])) >= template['items_required']
-    
-    quest['progress'] = progress
-    
-    if completed and not quest['completed']:
-        quest['completed'] = True
-        quest['completed_at'] = datetime.now().isoformat()
-        
-        # Award rewards
-        user['xp'] += quest['xp_reward']
-        user['coins'] += quest['coin_reward']
-        user['total_coins_earned'] += quest['coin_reward']
-        
-        # Move quest to completed
-        if user_id in data['active_quests']:
-            data['active_quests'][user_id].remove(quest_id)
-        
-        if 'completed_quests' not in data:
-            data['completed_quests'] = {}
-        if user_id not in data['completed_quests']:
-            data['completed_quests'][user_id] = []
-        
-        data['completed_quests'][user_id].append(quest_id)
-        
-        # Check for level up
-        xp_for_next_level = user['level'] * 100
-        level_up = False
-        while user['xp'] >= xp_for_next_level:
-            user['level'] += 1
-            user['xp'] -= xp_for_next_level
-            xp_for_next_level = user['level'] * 100
-            level_up = True
-            user['coins'] += 50
-        
-        save_data(data)
-        
-        return jsonify({
+    # Progress is kept up to date as events happen; this only settles stat-based quests
+    level_before = user['level']
+    rules_engine.process(data, user_id, [rules.checked()])
+    
+    if quest['completed']:
+        return {
             'completed': True,
             'xp_reward': quest['xp_reward'],
             'coin_reward': quest['coin_reward'],
             'user': user,
-            'level_up': level_up,
+            'level_up': user['level'] > level_before,
             'message': f'Quest completed: {quest["name"]}!'
-        })
-    
-    save_data(data)
+        }, 200
     
-    return jsonify({
+    required = rules_engine.quest_required(quest)
+    return {
         'completed': False,
-        'progress': progress,
-        'required': template.get('tasks_required') or template.get('streak_required') or template.get('coins_required') or template.get('level_required') or template.get('items_required'),
-        'message': f'Progress: {progress}/{template.get("tasks_required") or template.get("streak_required") or template.get("coins_required") or template.get("level_required") or template.get("items_required")}'
-    })
+        'progress': quest['progress'],
+        'required': required,
+        'message': f'Progress: {quest["progress"]}/{required}'
+    }, 200
+
+@app.route('/api/quests/<quest_id>/check', methods=['POST'])
+@user_transaction
+
+def check_quest_progress(quest_id):
+    """Check if quest objective is met and complete if so"""
+    user_id = get_user_id()
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = load_data(user_id)
+    
+    body, status = apply_check_quest(data, user_id, quest_id)
+    if status == 200:
+        save_data(data, 'quest_completed' if body['completed'] else 'quest_checked')
+    return jsonify(body), status
@@ -0,0 +1,78 @@
+"""In-process publish/subscribe behind the /api/events Server-Sent Events stream.
+
+Each open stream subscribes a queue to its user.  Write paths and background
+jobs publish small typed events to a user (or everyone) and the stream turns
+them into SSE frames.  Subscribers live in the worker that accepted the
+connection, so each worker publishes what it sees to its own subscribers.
+"""
+import json
+import queue
+import threading
+
+
+class EventHub:
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self.subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        events = queue.Queue(self.max_queued)
+        with self._lock:
+            self.subscribers.setdefault(user_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self._lock:
+            queues = self.subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(events)
+                if not queues:
+                    del self.subscribers[user_id]
+
+    def publish(self, user_id, event_type, data):
+        with self._lock:
+            queues = list(self.subscribers.get(user_id, ()))
+        for events in queues:
+            try:
+                events.put_nowait((event_type, data))
+            except queue.Full:
+                pass  # the client stopped reading; it re-syncs when it reconnects
+
+    def broadcast(self, event_type, data):
+        with self._lock:
+            user_ids = list(self.subscribers)
+        for user_id in user_ids:
+            self.publish(user_id, event_type, data)
+
+
+def format_event(event_type, data):
+    return f'event: {event_type}\ndata: {json.dumps(data)}\n\n'
+
+
+def sse_stream(hub, user_id, heartbeat_seconds=15, version=None):
+    """Yield SSE frames for user_id until the client disconnects.
+
+    version() returns the user's stored data version.  Writes made through
+    other workers never reach this hub, so when the version moved between two
+    heartbeats the client gets a resync event and reloads what it shows.
+    """
+    events = hub.subscribe(user_id)
+    try:
+        seen = version() if version else None
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event_type, data = events.get(timeout=heartbeat_seconds)
+            except queue.Empty:
+                current = version() if version else None
+                if current != seen:
+                    seen = current
+                    yield format_event('resync', {})
+                    continue
+                # Comment line: keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            yield format_event(event_type, data)
+    finally:
+        hub.unsubscribe(user_id, events)
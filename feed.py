@@ -0,0 +1,96 @@
+"""Time-ordered index of the social feed.
+
+Shares are kept sorted by (timestamp, id), so a page before or after a cursor
+is a bisect plus a slice instead of sorting every share on each request.
+"""
+import base64
+import bisect
+import threading
+import time
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode('|'.join(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(timestamp, share_id) from an opaque cursor; ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+    timestamp, sep, share_id = raw.partition('|')
+    if not sep:
+        raise ValueError('invalid cursor')
+    return timestamp, share_id
+
+
+class SocialFeed:
+    """Shares ordered by time, oldest first internally, newest first in pages"""
+
+    def __init__(self, refresh_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.keys = []
+        self.shares = {}
+        self.built_at = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(share_id, share):
+        return share.get('timestamp', ''), share_id
+
+    def rebuild(self, shares):
+        with self._lock:
+            self.shares = dict(shares)
+            self.keys = sorted(self._key(share_id, share) for share_id, share in self.shares.items())
+            self.built_at = time.monotonic()
+
+    def ensure_fresh(self, load_shares):
+        """Build on first use and re-sync now and then to pick up other workers' writes"""
+        with self._lock:
+            if self.built_at is None or time.monotonic() - self.built_at > self.refresh_seconds:
+                self.rebuild(load_shares())
+
+    def update(self, share_id, share):
+        """Add, replace or (share=None) drop one share"""
+        with self._lock:
+            if self.built_at is None:
+                return
+            old = self.shares.pop(share_id, None)
+            if old is not None:
+                key = self._key(share_id, old)
+                index = bisect.bisect_left(self.keys, key)
+                if index < len(self.keys) and self.keys[index] == key:
+                    del self.keys[index]
+            if share is not None:
+                self.shares[share_id] = share
+                key = self._key(share_id, share)
+                # New shares are almost always the newest, so this is an append
+                if not self.keys or self.keys[-1] < key:
+                    self.keys.append(key)
+                else:
+                    bisect.insort(self.keys, key)
+
+    def page(self, limit, before=None, after=None, since=''):
+        """Up to limit shares newest first, older than before or newer than after.
+
+        Shares with a timestamp before since are left out.  Returns
+        (shares, next_cursor, prev_cursor): pass next_cursor as before to page
+        back in time and prev_cursor as after to fetch newer shares.
+        """
+        with self._lock:
+            low = bisect.bisect_left(self.keys, (since, ''))
+            if after is not None:
+                start = max(bisect.bisect_right(self.keys, after), low)
+                end = min(start + limit, len(self.keys))
+            else:
+                end = bisect.bisect_left(self.keys, before) if before is not None else len(self.keys)
+                start = max(end - limit, low)
+            keys = self.keys[start:end] if start < end else []
+            shares = [self.shares[share_id] for _, share_id in reversed(keys)]
+            next_cursor = encode_cursor(keys[0]) if keys and start > low else None
+            prev_cursor = encode_cursor(keys[-1]) if keys else (encode_cursor(after) if after else None)
+            return shares, next_cursor, prev_cursor
+
+    def __len__(self):
+        return len(self.keys)
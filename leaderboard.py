@@ -0,0 +1,195 @@
+"""Incrementally maintained leaderboards.
+
+Every ranking is an indexable skip list of sort keys, so moving one user after
+their stats change costs O(log n) and reading the top N costs O(log n + N)
+instead of sorting every user on each request.
+"""
+import random
+import threading
+import time
+
+
+class _Node:
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, height):
+        self.value = value
+        self.next = [None] * height
+        # width[i] = how many positions next[i] is ahead of this node
+        self.width = [1] * height
+
+
+class IndexableSkipList:
+    """Sorted collection of unique values with O(log n) insert, remove, rank and index"""
+
+    MAX_LEVEL = 32
+
+    def __init__(self):
+        self.head = _Node(None, self.MAX_LEVEL)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_height(self):
+        height = 1
+        while height < self.MAX_LEVEL and random.random() < 0.5:
+            height += 1
+        return height
+
+    def insert(self, value):
+        update = [None] * self.MAX_LEVEL
+        positions = [0] * self.MAX_LEVEL
+        node, pos = self.head, 0
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].value < value:
+                pos += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            positions[level] = pos
+        new = _Node(value, self._random_height())
+        for level in range(len(new.next)):
+            prev = update[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            gap = pos + 1 - positions[level]
+            new.width[level] = prev.width[level] + 1 - gap
+            prev.width[level] = gap
+        for level in range(len(new.next), self.MAX_LEVEL):
+            update[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        update = [None] * self.MAX_LEVEL
+        node = self.head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].value < value:
+                node = node.next[level]
+            update[level] = node
+        target = update[0].next[0]
+        if target is None or target.value != value:
+            raise ValueError(f'{value!r} not in skip list')
+        for level in range(self.MAX_LEVEL):
+            prev = update[level]
+            if prev.next[level] is target:
+                prev.width[level] += target.width[level] - 1
+                prev.next[level] = target.next[level]
+            else:
+                prev.width[level] -= 1
+        self.size -= 1
+
+    def rank(self, value):
+        """0-based position of value"""
+        node, pos = self.head, 0
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].value < value:
+                pos += node.width[level]
+                node = node.next[level]
+        candidate = node.next[0]
+        if candidate is None or candidate.value != value:
+            raise ValueError(f'{value!r} not in skip list')
+        return pos
+
+    def _node_at(self, index):
+        node, pos = self.head, 0
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and pos + node.width[level] <= index + 1:
+                pos += node.width[level]
+                node = node.next[level]
+        return node
+
+    def iter_from(self, start, count):
+        """Yield up to count values starting at position start"""
+        if start >= self.size or count <= 0:
+            return
+        node = self._node_at(max(start, 0))
+        while node is not None and count > 0:
+            yield node.value
+            node = node.next[0]
+            count -= 1
+
+
+class Leaderboards:
+    """A set of rankings over the same users.
+
+    metrics maps a board name to a function giving the sort key of an entry
+    (smaller sorts first); make_entry turns a stored user into the entry the
+    API returns.  Ties are broken by user id.
+    """
+
+    def __init__(self, metrics, make_entry, refresh_seconds=60):
+        self.metrics = metrics
+        self.make_entry = make_entry
+        self.refresh_seconds = refresh_seconds
+        self.entries = {}
+        self.boards = {name: IndexableSkipList() for name in metrics}
+        self.built_at = None
+        # Bumped on every change, for conditional GETs of the boards
+        self.version = 0
+        self.changed_at = None
+        self._lock = threading.RLock()
+
+    def _keys(self, user_id, entry):
+        return {name: (*key(entry), user_id) for name, key in self.metrics.items()}
+
+    def rebuild(self, users):
+        with self._lock:
+            self.entries = {}
+            self.boards = {name: IndexableSkipList() for name in self.metrics}
+            for user_id, user in users.items():
+                self._insert(user_id, self.make_entry(user_id, user))
+            self.built_at = time.monotonic()
+            self._changed()
+
+    def ensure_fresh(self, load_users):
+        """Build on first use and re-sync now and then to pick up other workers' writes"""
+        with self._lock:
+            if self.built_at is None or time.monotonic() - self.built_at > self.refresh_seconds:
+                self.rebuild(load_users())
+
+    def _insert(self, user_id, entry):
+        self.entries[user_id] = entry
+        for name, key in self._keys(user_id, entry).items():
+            self.boards[name].insert(key)
+
+    def update(self, user_id, user):
+        """Move one user to their new place on every board (user=None removes them)"""
+        with self._lock:
+            if self.built_at is None:
+                return
+            old = self.entries.pop(user_id, None)
+            if old is not None:
+                for name, key in self._keys(user_id, old).items():
+                    self.boards[name].remove(key)
+            if user is not None:
+                self._insert(user_id, self.make_entry(user_id, user))
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self.changed_at = time.time()
+
+    def rank(self, name, user_id):
+        """1-based rank of user_id on board name, or None if unknown"""
+        with self._lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            return self.boards[name].rank((*self.metrics[name](entry), user_id)) + 1
+
+    def page(self, name, start, count):
+        """Entries at ranks start+1 .. start+count of board name"""
+        with self._lock:
+            return [dict(self.entries[key[-1]]) for key in self.boards[name].iter_from(start, count)]
+
+    def around(self, name, user_id, radius):
+        """(rank, entries) for user_id and up to radius users either side of them"""
+        with self._lock:
+            rank = self.rank(name, user_id)
+            if rank is None:
+                return None, []
+            start = max(rank - 1 - radius, 0)
+            return rank, self.page(name, start, rank - start + radius)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,99 @@
+"""Versioned schema migrations for the user data document.
+
+Each migration upgrades the document from the previous version in place.
+The version reached is kept in data['meta']['schema'], so migrations run once
+(at startup or via `flask migrate`) instead of on every request.
+"""
+from datetime import datetime
+
+PROFILE_DEFAULTS = {
+    'level': 1,
+    'xp': 0,
+    'coins': 0,
+    'streak': 0,
+    'last_completed_date': None,
+    'total_tasks_completed': 0,
+    'badges': [],
+    'active_quests': [],
+    'completed_quests': [],
+    'active_challenges': [],
+    'completed_challenges': [],
+    'theme': 'light',
+}
+
+
+def inventory_from_avatar_customizations(document, usernames):
+    """Old profiles kept purchases in avatar_customizations (with a 'default' entry)"""
+    for user in document.get('users', {}).values():
+        if 'avatar_customizations' in user and 'inventory' not in user:
+            user['inventory'] = [item for item in user['avatar_customizations'] if item != 'default']
+            del user['avatar_customizations']
+        user.setdefault('inventory', [])
+
+
+def backfill_profile_fields(document, usernames):
+    """Give every profile the fields initialize_user() used to add on each request"""
+    now = datetime.now().isoformat()
+    for user_id, user in document.get('users', {}).items():
+        for field, default in PROFILE_DEFAULTS.items():
+            if field not in user:
+                user[field] = list(default) if isinstance(default, list) else default
+        if 'username' not in user:
+            user['username'] = usernames.get(user_id, 'Player')
+        if 'joined_date' not in user:
+            user['joined_date'] = now
+        if 'total_coins_earned' not in user:
+            user['total_coins_earned'] = user.get('coins', 0)
+
+
+def completion_log_from_completed_dates(document, usernames):
+    """Seed each user's completion log from the dates on their tasks (time of day unknown: midnight)"""
+    logs = document.setdefault('completions', {})
+    for task_id, task in document.get('tasks', {}).items():
+        user_id = task.get('user_id')
+        if not user_id:
+            continue
+        log = logs.setdefault(user_id, {'user_id': user_id, 'events': []})
+        log['events'].extend([f'{day}T00:00:00', task_id] for day in task.get('completed_dates', []))
+    for log in logs.values():
+        log['events'].sort()
+
+
+# (version, migration); a document at version N has had every migration <= N applied
+MIGRATIONS = [
+    (1, inventory_from_avatar_customizations),
+    (2, backfill_profile_fields),
+    (3, completion_log_from_completed_dates),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(document):
+    return document.get('meta', {}).get('schema', {}).get('version', 0)
+
+
+def migrate_document(document, usernames=None):
+    """Run the pending migrations on document in place and return their names"""
+    version = schema_version(document)
+    applied = []
+    for target, migration in MIGRATIONS:
+        if target > version:
+            migration(document, usernames or {})
+            applied.append(migration.__name__)
+    if applied:
+        document.setdefault('meta', {})['schema'] = {
+            'version': SCHEMA_VERSION,
+            'migrated_at': datetime.now().isoformat(),
+        }
+    return applied
+
+
+def run_migrations(store, usernames=None):
+    """Bring the store up to SCHEMA_VERSION with a single save; cheap when it already is"""
+    if schema_version(store.load(sections=('meta',))) >= SCHEMA_VERSION:
+        return []
+    document = store.load()
+    applied = migrate_document(document, usernames)
+    store.save(document, 'schema_migrated')
+    return applied
@@ -0,0 +1,101 @@
+"""Password hashing off the request thread.
+
+Hashing or checking a password with scrypt costs tens of milliseconds of
+CPU, so it runs in a small process pool instead of the worker that serves
+API requests.  At most max_pending calls may be queued or running at once;
+beyond that callers get PasswordPoolBusy straight away, so a burst of logins
+is turned away instead of stalling everything else.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class PasswordPoolBusy(Exception):
+    """Too many password hashes are already queued (or one took longer than the timeout)"""
+
+
+def hash_method(pwhash):
+    """The method part of a werkzeug hash ('scrypt:32768:8:1', 'pbkdf2:sha256:600000', ...)"""
+    return pwhash.split('$', 1)[0]
+
+
+def full_method(method):
+    """method with werkzeug's defaults filled in, as it appears in the hashes it makes"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2' and len(args) <= 2:
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f'Invalid hash method: {method}')
+
+
+class PasswordHasher:
+    """generate/check_password_hash on a process pool (workers=0: inline, for tests and tools).
+
+    method is anything generate_password_hash() accepts; hashes made with
+    other parameters are reported by needs_rehash() so login can upgrade them.
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', workers=2, max_pending=16, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._full_method = full_method(method)
+
+    def _executor(self):
+        with self._lock:
+            # A forked worker can't use its parent's pool
+            if self._pool is None or self._pid != os.getpid():
+                # Forking a threaded server can copy locks held by other threads
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver') if 'forkserver' in methods else None
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordPoolBusy()
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the job is done, not just until we stop waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()  # only succeeds if it hasn't started
+            raise PasswordPoolBusy()
+        except BrokenProcessPool:
+            # A pool process died; start a new pool for the next call
+            with self._lock:
+                self._pool = None
+            raise
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return hash_method(pwhash) != self._full_method
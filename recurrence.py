@@ -0,0 +1,79 @@
+"""Occurrences of recurring tasks.
+
+A recurring task is due once per period, counted from the day it was created.
+Occurrences are generated lazily for the requested range (the first one is
+found arithmetically, not by walking from the creation date) and merged with
+the completion log to tell which were done and which were missed.
+"""
+import heapq
+from bisect import bisect_left
+from datetime import date, datetime
+
+# frequency -> period length in days ('custom' tasks have no fixed period and are not expanded)
+FREQUENCY_DAYS = {
+    'daily': 1,
+    'weekly': 7,
+}
+
+
+def period_days(task):
+    if not task.get('recurring'):
+        return None
+    return FREQUENCY_DAYS.get(task.get('frequency', 'daily'))
+
+
+def _anchor(task):
+    created_at = task.get('created_at')
+    return datetime.fromisoformat(created_at).date().toordinal() if created_at else None
+
+
+def occurrences(task, start, end):
+    """Yield the ordinal day of each occurrence of task with start <= day < end (ordinals)"""
+    step = period_days(task)
+    anchor = _anchor(task)
+    if step is None or anchor is None:
+        return
+    first = max(start, anchor)
+    # Round up to the next day on the task's cycle
+    day = first + (anchor - first) % step
+    while day < end:
+        yield day
+        day += step
+
+
+def agenda(tasks, events, start, end, today):
+    """Occurrences of tasks between start and end (dates, end exclusive), oldest first.
+
+    events are completion log entries covering at least start .. end plus the
+    longest period.  Yields (day ordinal, task, status) with status 'done',
+    'missed', 'due' (its period includes today) or 'upcoming'.
+    """
+    start, end, today = start.toordinal(), end.toordinal(), today.toordinal()
+    completed = {}
+    for timestamp, task_id in events:
+        completed.setdefault(task_id, []).append(date.fromisoformat(timestamp[:10]).toordinal())
+
+    def expand(position, task):
+        step = period_days(task)
+        done_days = completed.get(task['id'], ())
+        index = 0
+        for day in occurrences(task, start, end):
+            # Done if completed at any point of this occurrence's period
+            index = bisect_left(done_days, day, index)
+            if index < len(done_days) and done_days[index] < day + step:
+                status = 'done'
+            elif day + step <= today:
+                status = 'missed'
+            elif day <= today:
+                status = 'due'
+            else:
+                status = 'upcoming'
+            yield day, position, status
+
+    recurring = [task for task in tasks if period_days(task)]
+    for day, position, status in heapq.merge(*(expand(position, task) for position, task in enumerate(recurring))):
+        yield day, recurring[position], status
+
+
+def longest_period(tasks):
+    return max((period_days(task) or 1 for task in tasks), default=1)
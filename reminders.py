@@ -0,0 +1,119 @@
+"""Task reminders, bucketed by scheduled minute.
+
+Tasks with a scheduled_time are indexed under that 'HH:MM' minute, so the
+ticker that wakes up once a minute only looks at the tasks due in that
+minute instead of every task of every user.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+
+def scheduled_minute(task):
+    """'HH:MM' of a task's scheduled_time, or None if it has none"""
+    value = (task.get('scheduled_time') or '')[:5]
+    if len(value) != 5 or value[2] != ':' or not (value[:2] + value[3:]).isdigit():
+        return None
+    return value
+
+
+class ReminderIndex:
+    def __init__(self):
+        # 'HH:MM' -> {task_id: reminder}
+        self.buckets = {}
+        self.minutes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _reminder(task_id, task):
+        completed_dates = task.get('completed_dates') or [None]
+        return {'task_id': task_id, 'user_id': task.get('user_id'), 'title': task.get('title'),
+                'scheduled_time': task.get('scheduled_time'), 'last_completed': completed_dates[-1]}
+
+    def _remove(self, task_id):
+        minute = self.minutes.pop(task_id, None)
+        if minute is not None:
+            bucket = self.buckets[minute]
+            del bucket[task_id]
+            if not bucket:
+                del self.buckets[minute]
+
+    def update(self, task_id, task):
+        """Re-index one task after it was saved (task=None: deleted)"""
+        with self._lock:
+            self._remove(task_id)
+            minute = scheduled_minute(task) if task else None
+            if minute is not None and task.get('user_id'):
+                self.buckets.setdefault(minute, {})[task_id] = self._reminder(task_id, task)
+                self.minutes[task_id] = minute
+
+    def rebuild(self, tasks):
+        with self._lock:
+            self.buckets = {}
+            self.minutes = {}
+        for task_id, task in tasks.items():
+            self.update(task_id, task)
+
+    def due(self, minute):
+        with self._lock:
+            return list(self.buckets.get(minute, {}).values())
+
+    def __len__(self):
+        return len(self.minutes)
+
+
+class ReminderTicker:
+    """Background thread that hands deliver() the reminders due each minute.
+
+    The index follows this worker's own writes as they are saved.  Tasks
+    created or rescheduled through other workers only reach it when
+    load_tasks() (every task) re-syncs the index, every resync_seconds, so
+    their reminders can be up to that late (or missed, if due before then).
+    """
+
+    def __init__(self, index, deliver, load_tasks, resync_seconds=300):
+        self.index = index
+        self.deliver = deliver
+        self.load_tasks = load_tasks
+        self.resync_seconds = resync_seconds
+        self.delivered = 0
+        self._thread = None
+        self._pid = None
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def tick(self, now=None):
+        """Deliver the reminders for now's minute of tasks not yet completed today"""
+        now = now or datetime.now()
+        today = now.date().isoformat()
+        due = [reminder for reminder in self.index.due(now.strftime('%H:%M'))
+               if reminder['last_completed'] != today]
+        for reminder in due:
+            self.deliver(reminder)
+        self.delivered += len(due)
+        return len(due)
+
+    def start(self):
+        """Start the thread once per process (safe to call on every request)"""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self._synced_at is None or time.monotonic() - self._synced_at > self.resync_seconds:
+                    self.index.rebuild(self.load_tasks())
+                    self._synced_at = time.monotonic()
+            except Exception as e:
+                print(f"Error loading reminders: {e}")
+            # Sleep to the start of the next minute, then fire that minute's bucket
+            time.sleep(60 - time.time() % 60 + 0.01)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error sending reminders: {e}")
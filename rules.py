@@ -0,0 +1,218 @@
+"""Incremental quest and challenge progress.
+
+Handlers that change a user's stats describe the change as a small event (a
+task completed, coins earned, a level gained, an item bought).  The engine
+feeds it to each of that user's active quests and challenges, awards the
+rewards of the ones it completes in the same document, and feeds the events
+those rewards cause back in.  The /check endpoints then only read progress.
+"""
+from collections import deque
+from datetime import datetime, time, timedelta
+
+from activity import completion_log, count_between, count_for_constraint, in_time_constraint
+
+# Template fields holding a quest's target, in the order the old /check endpoint tried them
+REQUIREMENT_FIELDS = ('tasks_required', 'streak_required', 'coins_required', 'level_required', 'items_required')
+
+EARLY_BIRD_BEFORE = time(9, 0)
+
+
+def task_completed(task_id, at):
+    return {'type': 'task_completed', 'task_id': task_id, 'at': at}
+
+
+def coins_earned(amount):
+    return {'type': 'coins_earned', 'amount': amount}
+
+
+def level_up(level):
+    return {'type': 'level_up', 'level': level}
+
+
+def item_purchased(item_id):
+    return {'type': 'item_purchased', 'item': item_id}
+
+
+def checked():
+    """No-op event: re-evaluates quests that depend only on the user's current stats"""
+    return {'type': 'checked'}
+
+
+def award(user, xp, coins):
+    """Add rewards, apply level-ups and return the events they cause"""
+    user['xp'] += xp
+    user['coins'] += coins
+    user['total_coins_earned'] = user.get('total_coins_earned', 0) + coins
+    events = []
+    xp_for_next_level = user['level'] * 100
+    while user['xp'] >= xp_for_next_level:
+        user['level'] += 1
+        user['xp'] -= xp_for_next_level
+        xp_for_next_level = user['level'] * 100
+        user['coins'] += 50
+        coins += 50
+        events.append(level_up(user['level']))
+    if coins:
+        events.insert(0, coins_earned(coins))
+    return events
+
+
+class RulesEngine:
+    def __init__(self, quest_templates, challenge_templates, shop_items):
+        self.quest_templates = quest_templates
+        self.challenge_templates = challenge_templates
+        self.shop_items = shop_items
+        # template id -> rule(quest, user, event) returning the quest's new progress
+        self.quest_rules = {
+            'early_bird': self._early_bird,
+            'streak_master': lambda quest, user, event: user['streak'],
+            'coin_collector': self._coin_collector,
+            'level_up': lambda quest, user, event: user['level'],
+            'shopping_spree': lambda quest, user, event: len(user.get('inventory', [])),
+        }
+
+    # ---- rules ----
+
+    @staticmethod
+    def _early_bird(quest, user, event):
+        at = event.get('at') or datetime.now()
+        if quest.get('progress_day') != at.date().isoformat():
+            # Only today's morning counts
+            quest['progress_day'] = at.date().isoformat()
+            quest['progress'] = 0
+        if event['type'] == 'task_completed' and at.time() < EARLY_BIRD_BEFORE:
+            return quest['progress'] + 1
+        return quest['progress']
+
+    @staticmethod
+    def _coin_collector(quest, user, event):
+        if event['type'] == 'coins_earned':
+            return quest['progress'] + event['amount']
+        return quest['progress']
+
+    def _challenge(self, challenge, event):
+        if event['type'] != 'task_completed':
+            return challenge['progress']
+        start = datetime.fromisoformat(challenge['started_at'])
+        end = start + timedelta(hours=challenge.get('duration_hours', 24))
+        at = event['at']
+        if start <= at < end and in_time_constraint(at, self._setting(challenge, self.challenge_templates,
+                                                                        'time_constraint')):
+            return challenge['progress'] + 1
+        return challenge['progress']
+
+    # ---- starting progress ----
+
+    def seed_quest(self, quest, user, data):
+        """Progress of a quest from what already happened, computed once when tracking starts"""
+        template_id = quest['template_id']
+        if template_id == 'early_bird':
+            today = datetime.combine(datetime.now().date(), time())
+            quest['progress_day'] = today.date().isoformat()
+            quest['progress'] = count_between(completion_log(data, quest['user_id']), today,
+                                              datetime.combine(today.date(), EARLY_BIRD_BEFORE))
+        elif template_id == 'coin_collector':
+            # Total coins earned: current + spent on items
+            quest['progress'] = user['coins'] + sum(self.shop_items[item]['cost']
+                                                    for item in user.get('inventory', [])
+                                                    if item in self.shop_items)
+        else:
+            quest['progress'] = self.quest_rules[template_id](quest, user, checked())
+        quest['tracked'] = True
+
+    def seed_challenge(self, challenge, data):
+        start = datetime.fromisoformat(challenge['started_at'])
+        end = start + timedelta(hours=challenge.get('duration_hours', 24))
+        challenge['progress'] = count_for_constraint(completion_log(data, challenge['user_id']), start, end,
+                                                     self._setting(challenge, self.challenge_templates,
+                                                                   'time_constraint'))
+        challenge['tracked'] = True
+
+    # ---- lookups ----
+
+    @staticmethod
+    def _setting(item, templates, field):
+        """A template field, from the copy kept on the quest/challenge or else the template"""
+        metadata = item.get('metadata') or {}
+        if field in metadata:
+            return metadata[field]
+        return templates.get(item['template_id'], {}).get(field)
+
+    def quest_required(self, quest):
+        for field in REQUIREMENT_FIELDS:
+            value = self._setting(quest, self.quest_templates, field)
+            if value:
+                return value
+        return None
+
+    def challenge_required(self, challenge):
+        return self._setting(challenge, self.challenge_templates, 'tasks_required') or 1
+
+    def active_quests(self, data, user_id):
+        for quest_id in list(data.get('active_quests', {}).get(user_id, [])):
+            quest = data['quests'].get(quest_id)
+            if quest and not quest.get('completed') and quest.get('template_id') in self.quest_rules:
+                yield quest_id, quest
+
+    def active_challenges(self, data, user_id, now=None):
+        now = now or datetime.now()
+        for challenge_id, challenge in list(data.get('challenges', {}).items()):
+            if challenge.get('user_id') != user_id or challenge.get('completed'):
+                continue
+            expires_at = (datetime.fromisoformat(challenge['started_at'])
+                          + timedelta(hours=challenge.get('duration_hours', 24)))
+            if now < expires_at:
+                yield challenge_id, challenge
+
+    # ---- evaluation ----
+
+    def process(self, data, user_id, events):
+        """Apply events to the user's active quests and challenges.
+
+        Returns (quests, challenges) completed by them, with rewards already
+        added to the user.
+        """
+        user = data['users'][user_id]
+        # Seeding counts what data already holds, and events have already been
+        # applied to it, so items seeded here skip them (but not the events
+        # their rewards cause below)
+        seeded = set()
+        for quest_id, quest in self.active_quests(data, user_id):
+            if not quest.get('tracked'):
+                self.seed_quest(quest, user, data)
+                seeded.add(('quests', quest_id))
+        for challenge_id, challenge in self.active_challenges(data, user_id):
+            if not challenge.get('tracked'):
+                self.seed_challenge(challenge, data)
+                seeded.add(('challenges', challenge_id))
+        queue = deque(events)
+        unprocessed = len(queue)
+        completed_quests, completed_challenges = [], []
+        while queue:
+            event = queue.popleft()
+            counted = seeded if unprocessed > 0 else ()
+            unprocessed -= 1
+            for quest_id, quest in self.active_quests(data, user_id):
+                if ('quests', quest_id) not in counted:
+                    quest['progress'] = self.quest_rules[quest['template_id']](quest, user, event)
+                required = self.quest_required(quest)
+                if required is not None and quest['progress'] >= required:
+                    self._complete_quest(data, user_id, quest_id, quest)
+                    completed_quests.append(quest)
+                    queue.extend(award(user, quest['xp_reward'], quest['coin_reward']))
+            for challenge_id, challenge in self.active_challenges(data, user_id):
+                if ('challenges', challenge_id) not in counted:
+                    challenge['progress'] = self._challenge(challenge, event)
+                if challenge['progress'] >= self.challenge_required(challenge):
+                    challenge['completed'] = True
+                    challenge['completed_at'] = datetime.now().isoformat()
+                    completed_challenges.append(challenge)
+                    queue.extend(award(user, challenge['xp_reward'], challenge['coin_reward']))
+        return completed_quests, completed_challenges
+
+    @staticmethod
+    def _complete_quest(data, user_id, quest_id, quest):
+        quest['completed'] = True
+        quest['completed_at'] = datetime.now().isoformat()
+        data['active_quests'][user_id].remove(quest_id)
+        data.setdefault('completed_quests', {}).setdefault(user_id, []).append(quest_id)
@@ -0,0 +1,123 @@
+"""Expiry of time-limited records (running challenges, challenge invitations).
+
+A min-heap of (expires_at, section, key) says when the next record runs out,
+so one background thread per worker sleeps until then and expires everything
+that is due in a single save, instead of read endpoints checking and
+rewriting every record on each request.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class ExpiryScheduler:
+    """expire(due) gets a list of (section, key) whose deadline has passed and
+    does the actual write; load_entries() yields (expires_at, section, key) for
+    every record that can still expire and is used to (re)build the heap.
+    """
+
+    def __init__(self, expire, load_entries, poll_seconds=60, resync_seconds=300):
+        self.expire = expire
+        self.load_entries = load_entries
+        self.poll_seconds = poll_seconds
+        self.resync_seconds = resync_seconds
+        self.heap = []
+        # (section, key) -> current deadline; heap entries that disagree are stale
+        self.deadlines = {}
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._synced_at = None
+
+    def schedule(self, section, key, expires_at):
+        with self._lock:
+            if self.deadlines.get((section, key)) == expires_at:
+                return
+            self.deadlines[(section, key)] = expires_at
+            heapq.heappush(self.heap, (expires_at, section, key))
+            earliest = self.heap[0][0] == expires_at
+        if earliest:
+            self._wakeup.set()
+
+    def cancel(self, section, key):
+        with self._lock:
+            self.deadlines.pop((section, key), None)
+
+    def rebuild(self, entries):
+        """Merge in deadlines read from the store.
+
+        Entries scheduled meanwhile are kept; a stale one only costs expire()
+        a check of the record, which it does anyway.
+        """
+        loaded = {(section, key): expires_at for expires_at, section, key in entries}
+        with self._lock:
+            self.deadlines.update(loaded)
+            self.heap = [(expires_at, section, key) for (section, key), expires_at in self.deadlines.items()]
+            heapq.heapify(self.heap)
+            self._synced_at = time.monotonic()
+
+    def pop_due(self, now):
+        """Remove and return the (section, key) of every record due by now"""
+        due = []
+        with self._lock:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, section, key = heapq.heappop(self.heap)
+                if self.deadlines.get((section, key)) == expires_at:
+                    del self.deadlines[(section, key)]
+                    due.append((section, key))
+        return due
+
+    def seconds_until_next(self, now):
+        with self._lock:
+            while self.heap and self.deadlines.get(self.heap[0][1:]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            if not self.heap:
+                return None
+            return (self.heap[0][0] - now).total_seconds()
+
+    def run_once(self, now=None):
+        """Expire everything due; returns how many records were handed to expire()"""
+        now = now or datetime.now()
+        due = self.pop_due(now)
+        if due:
+            try:
+                self.expire(due)
+            except Exception:
+                # Put them back; they are retried after the next poll
+                for section, key in due:
+                    self.schedule(section, key, now)
+                raise
+            self.expired += len(due)
+        return len(due)
+
+    def start(self):
+        """Start the background thread once per process (safe to call on every request)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            wait = self.poll_seconds
+            try:
+                if self._synced_at is None or time.monotonic() - self._synced_at > self.resync_seconds:
+                    # Picks up records created by other workers
+                    self.rebuild(self.load_entries())
+                self.run_once()
+                until_next = self.seconds_until_next(datetime.now())
+                if until_next is not None:
+                    wait = min(wait, max(until_next, 0.05))
+            except Exception as e:
+                print(f"Error expiring records: {e}")
+                self._wakeup.clear()
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
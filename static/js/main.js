@@ -4,6 +4,8 @@ const API_BASE = '';
 // State
 let userData = null;
 let tasks = [];
+// Change version of the tasks we hold; refreshes only fetch what changed since
+let tasksVersion = null;
 
 // Shop items - must match backend
 const SHOP_ITEMS = {
@@ -19,9 +21,6 @@ const SHOP_ITEMS = {
 
 // Initialize app
 document.addEventListener('DOMContentLoaded', () => {
-    loadUserData();
-    loadTasks();
-    
     // Setup form handler
     document.getElementById('taskForm').addEventListener('submit', handleTaskSubmit);
     // Settings button and form handlers (if present)
@@ -42,17 +41,44 @@ document.addEventListener('DOMContentLoaded', () => {
         uploadBtn.addEventListener('click', uploadAvatar);
     }
 
-    // Load existing settings to populate the modal
-    loadSettings();
-    
-    // Check for notifications every minute
-    setInterval(checkNotifications, 60000);
-    // Load and apply theme preference
-    loadTheme();
     // Inject theme switcher UI
     injectThemeSwitcher();
+    // User, tasks, settings and theme in one go
+    loadBootstrap();
+    
+    // Task reminders are pushed by the server
+    subscribeToReminders();
 });
 
+// Initial page data: embedded in the page when signed in, else fetched in one request
+async function loadBootstrap() {
+    let data = null;
+    const embedded = document.getElementById('bootstrapData');
+    try {
+        if (embedded) {
+            data = JSON.parse(embedded.textContent);
+        } else {
+            const response = await fetch(`${API_BASE}/api/bootstrap`);
+            if (response.ok) data = await response.json();
+        }
+    } catch (error) {
+        console.warn('Could not load page data:', error);
+    }
+    if (!data) {
+        loadUserData();
+        loadTasks();
+        loadSettings();
+        loadTheme();
+        return;
+    }
+    showUserData(data);
+    tasks = data.tasks;
+    tasksVersion = data.tasks_version;
+    renderTasks();
+    applySettings(data.settings);
+    applyTheme(data.theme);
+}
+
 // Theme functions
 async function loadTheme(){
     try{
@@ -130,16 +156,20 @@ async function loadUserData() {
     try {
         const response = await fetch(`${API_BASE}/api/user`);
         const data = await response.json();
-        userData = data.user;
-        updateUserStats(data);
-        updateBadges();
-        updateShop();
+        showUserData(data);
     } catch (error) {
         console.error('Error loading user data:', error);
         showNotification('Error loading user data', 'error');
     }
 }
 
+function showUserData(data) {
+    userData = data.user;
+    updateUserStats(data);
+    updateBadges();
+    updateShop();
+}
+
 // Update user stats display
 function updateUserStats(data) {
     document.getElementById('userLevel').textContent = data.user.level;
@@ -157,9 +187,20 @@ function updateUserStats(data) {
 // Load tasks
 async function loadTasks() {
     try {
-        const response = await fetch(`${API_BASE}/api/tasks`);
+        const since = tasksVersion === null ? '' : `?since=${tasksVersion}`;
+        const response = await fetch(`${API_BASE}/api/tasks${since}`);
         const data = await response.json();
-        tasks = data.tasks;
+        if (tasksVersion === null || data.full) {
+            tasks = data.tasks;
+        } else {
+            const changed = new Map(data.tasks.map(task => [task.id, task]));
+            const removed = new Set(data.deleted);
+            const known = new Set(tasks.map(task => task.id));
+            tasks = tasks.filter(task => !removed.has(task.id))
+                .map(task => changed.get(task.id) || task)
+                .concat(data.tasks.filter(task => !known.has(task.id)));
+        }
+        tasksVersion = data.version;
         renderTasks();
     } catch (error) {
         console.error('Error loading tasks:', error);
@@ -300,6 +341,13 @@ async function completeTask(taskId) {
                 });
             }
             
+            // Show quests and challenges finished by this task
+            [...(data.quests_completed || []), ...(data.challenges_completed || [])].forEach(item => {
+                setTimeout(() => {
+                    showNotification(`🎯 Completed: ${item.name} (+${item.xp_reward} XP, +${item.coin_reward} Coins)`, 'success');
+                }, 1000);
+            });
+            
             // Confetti animation
             createConfetti();
         } else {
@@ -505,17 +553,12 @@ function createConfetti() {
 }
 
 // Check for notifications (task reminders)
-function checkNotifications() {
-    const now = new Date();
-    const currentTime = `${now.getHours().toString().padStart(2, '0')}:${now.getMinutes().toString().padStart(2, '0')}`;
-    
-    tasks.forEach(task => {
-        if (task.scheduled_time && task.scheduled_time === currentTime) {
-            const today = new Date().toISOString().split('T')[0];
-            if (!task.completed_dates || !task.completed_dates.includes(today)) {
-                showNotification(`⏰ Reminder: ${task.title}`, 'warning');
-            }
-        }
+function subscribeToReminders() {
+    // Reminders are sent by the server at each task's scheduled minute
+    const events = new EventSource(`${API_BASE}/api/events`);
+    events.addEventListener('reminder', (event) => {
+        const reminder = JSON.parse(event.data);
+        showNotification(`⏰ Reminder: ${reminder.title}`, 'warning');
     });
 }
 
@@ -532,22 +575,24 @@ async function loadSettings() {
         const resp = await fetch(`${API_BASE}/api/settings`);
         if (!resp.ok) return;
         const data = await resp.json();
-        const settings = data.settings || {};
+        applySettings(data.settings || {});
+    } catch (e) {
+        console.warn('Could not load settings', e);
+    }
+}
 
-        const xp = document.getElementById('defaultXp');
-        const coins = document.getElementById('defaultCoins');
-        const notif = document.getElementById('notificationsEnabled');
-        const avatarPreview = document.getElementById('avatarPreview');
+function applySettings(settings) {
+    const xp = document.getElementById('defaultXp');
+    const coins = document.getElementById('defaultCoins');
+    const notif = document.getElementById('notificationsEnabled');
+    const avatarPreview = document.getElementById('avatarPreview');
 
-        if (xp) xp.value = settings.default_xp_reward || 10;
-        if (coins) coins.value = settings.default_coin_reward || 5;
-        if (notif) notif.checked = settings.notifications_enabled === undefined ? true : settings.notifications_enabled;
+    if (xp) xp.value = settings.default_xp_reward || 10;
+    if (coins) coins.value = settings.default_coin_reward || 5;
+    if (notif) notif.checked = settings.notifications_enabled === undefined ? true : settings.notifications_enabled;
 
-        if (avatarPreview && settings.avatar_url) {
-            avatarPreview.innerHTML = `<img src="${settings.avatar_url}" alt="avatar" style="width:64px;height:64px;border-radius:8px;object-fit:cover;">`;
-        }
-    } catch (e) {
-        console.warn('Could not load settings', e);
+    if (avatarPreview && settings.avatar_url) {
+        avatarPreview.innerHTML = `<img src="${settings.avatar_url}" alt="avatar" style="width:64px;height:64px;border-radius:8px;object-fit:cover;">`;
     }
 }
 
@@ -0,0 +1,1174 @@
+"""Storage backends for the user data document.
+
+The app works on one dict shaped like user_data.json: a handful of sections
+('users', 'tasks', 'quests', ...) that each map an id to a JSON row.  A store
+hands out that dict (optionally scoped to one user's rows) and on save writes
+back only the rows that actually changed.
+"""
+import gc
+import json
+import marshal
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # Windows: thread locks only
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib json module
+    orjson = None
+
+SECTIONS = (
+    'users',
+    'tasks',
+    'achievements',
+    'quests',
+    'challenges',
+    'quest_templates',
+    'social',
+    'pending_challenges',
+    'active_quests',
+    'completed_quests',
+    'completions',
+    'task_sync',
+    'meta',
+)
+
+# Sections whose rows belong to a single user and are loaded for a user scope
+USER_SECTIONS = (
+    'users',
+    'tasks',
+    'quests',
+    'challenges',
+    'pending_challenges',
+    'active_quests',
+    'completed_quests',
+    'completions',
+    'task_sync',
+    'versions',
+)
+
+# Written by the store itself on every save (see BaseStore.user_version), so
+# not part of the documents handed out by load()
+VERSIONS_SECTION = 'versions'
+
+# Sections kept in a user's own shard file by the sharded backend
+SHARD_SECTIONS = (
+    'users',
+    'tasks',
+    'quests',
+    'challenges',
+    'active_quests',
+    'completed_quests',
+    'completions',
+    'task_sync',
+)
+
+# Profile fields copied into the cross-user summary (leaderboards, user list)
+SUMMARY_FIELDS = (
+    'username',
+    'level',
+    'xp',
+    'coins',
+    'streak',
+    'total_tasks_completed',
+    'badges',
+    'inventory',
+)
+
+
+def encode_row(value):
+    """Serialize one row the same way every time so unchanged rows compare equal"""
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def decode_row(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+# ============ SNAPSHOT CODECS ============
+
+class JsonCodec:
+    """Plain JSON, compact by default or indented for humans"""
+
+    def __init__(self, indent=None):
+        self.indent = indent
+
+    def dump(self, document, f):
+        if self.indent is None and orjson is not None:
+            f.write(orjson.dumps(document))
+            return
+        separators = (',', ':') if self.indent is None else None
+        f.write(json.dumps(document, indent=self.indent, separators=separators, ensure_ascii=False).encode('utf-8'))
+
+    def load(self, f):
+        data = f.read()
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+class BinaryCodec:
+    """Versioned binary snapshot: a header, then one length-prefixed marshal record per section.
+
+    marshal only handles the plain dict/list/str/number values JSON has, which
+    is all a document holds, and loads them several times faster than JSON.
+    """
+
+    MAGIC = b'TMSNAP'
+    VERSION = 1
+    HEADER = struct.Struct('>6sH')
+    LENGTH = struct.Struct('>I')
+    # Pinned so snapshots stay readable when Python's default changes
+    MARSHAL_VERSION = 4
+
+    def dump(self, document, f):
+        f.write(self.HEADER.pack(self.MAGIC, self.VERSION))
+        for section, rows in document.items():
+            record = marshal.dumps((section, rows), self.MARSHAL_VERSION)
+            f.write(self.LENGTH.pack(len(record)))
+            f.write(record)
+
+    def load(self, f):
+        magic, version = self.HEADER.unpack(f.read(self.HEADER.size))
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f'Unsupported snapshot format {magic!r} v{version}')
+        document = {}
+        while True:
+            prefix = f.read(self.LENGTH.size)
+            if not prefix:
+                return document
+            (length,) = self.LENGTH.unpack(prefix)
+            section, rows = marshal.loads(f.read(length))
+            document[section] = rows
+
+
+CODECS = {
+    'json': JsonCodec(),
+    'json-pretty': JsonCodec(indent=2),
+    'binary': BinaryCodec(),
+}
+
+
+# Reads currently pausing the GC, and whether it was enabled before the first of them
+_gc_pause_lock = threading.Lock()
+_gc_pause = {'depth': 0, 'was_enabled': False}
+
+
+@contextmanager
+def gc_paused():
+    """Disable the cyclic GC until the last overlapping gc_paused() block ends"""
+    with _gc_pause_lock:
+        if _gc_pause['depth'] == 0:
+            _gc_pause['was_enabled'] = gc.isenabled()
+            gc.disable()
+        _gc_pause['depth'] += 1
+    try:
+        yield
+    finally:
+        with _gc_pause_lock:
+            _gc_pause['depth'] -= 1
+            if _gc_pause['depth'] == 0 and _gc_pause['was_enabled']:
+                gc.enable()
+
+
+def read_snapshot(path):
+    """Read a data file written by any codec (binary files are recognised by their header)"""
+    # Decoding allocates a container per row; pausing the cyclic GC stops it
+    # from rescanning the growing heap over and over while it does
+    with gc_paused(), open(path, 'rb') as f:
+        if f.read(len(BinaryCodec.MAGIC)) == BinaryCodec.MAGIC:
+            f.seek(0)
+            return CODECS['binary'].load(f)
+        f.seek(0)
+        return CODECS['json'].load(f)
+
+
+def write_snapshot(path, document, codec):
+    """Atomically replace path with document encoded by codec (temp file + fsync + rename)"""
+    os.replace(write_temp_snapshot(path, document, codec), path)
+
+
+def write_temp_snapshot(path, document, codec, tmp_path=None):
+    """Write and fsync document next to path; returns the temp path to rename over it"""
+    tmp_path = tmp_path or f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        codec.dump(document, f)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+class ConflictError(Exception):
+    """A row was changed by another request after this one loaded it"""
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path shared by every worker process (no-op without fcntl)"""
+    f = lock_file(path)
+    try:
+        yield
+    finally:
+        unlock_file(f)
+
+
+def lock_file(path):
+    """Take file_lock(path) without a with block; returns the handle for unlock_file()"""
+    if fcntl is None:
+        return None
+    f = open(path, 'a')
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    return f
+
+
+def unlock_file(f):
+    if f is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+class LockStripes:
+    """Per-user locks striped over a fixed number of slots.
+
+    Each stripe is a thread lock plus a one-byte fcntl record lock in a shared
+    lock file, so it also excludes other worker processes.  Users that hash to
+    different stripes never wait for each other.
+    """
+
+    def __init__(self, path, stripes=64):
+        self.path = path
+        self.stripes = stripes
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._fd = None
+        self._pid = None
+
+    def stripe(self, key):
+        return zlib.crc32(key.encode('utf-8')) % self.stripes
+
+    def _lock_file(self):
+        # Record locks belong to a process, so a forked worker opens its own fd
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    @contextmanager
+    def hold(self, key):
+        stripe = self.stripe(key)
+        with self._locks[stripe]:
+            if fcntl is None:
+                yield
+                return
+            fd = self._lock_file()
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, stripe)
+
+
+def check_expected(expected, current):
+    """Raise ConflictError unless each row still has the encoded form the handler loaded.
+
+    expected maps (section, key) to the loaded text (None for rows that did not
+    exist) and current(section, key) returns the stored text now.
+    """
+    for (section, key), text in (expected or {}).items():
+        if current(section, key) != text:
+            raise ConflictError(f'{section}/{key} changed since it was loaded')
+
+
+def document_text(document):
+    """A check_expected() lookup for rows of a plain in-memory document"""
+    def current(section, key):
+        value = document.get(section, {}).get(key)
+        return encode_row(value) if value is not None else None
+    return current
+
+
+def apply_to_document(document, changes):
+    """Apply (section, key, encoded_row) changes to a plain document dict in place"""
+    for section, key, text in changes:
+        rows = document.setdefault(section, {})
+        if text is None:
+            rows.pop(key, None)
+        else:
+            rows[key] = decode_row(text)
+
+
+def user_summary(user):
+    return {field: user[field] for field in SUMMARY_FIELDS if field in user}
+
+
+def row_owners(section, key, value):
+    """Return the user ids a row belongs to (empty for global rows)"""
+    if section in ('users', 'active_quests', 'completed_quests', 'completions', 'task_sync', VERSIONS_SECTION):
+        return (key,)
+    if not isinstance(value, dict):
+        return ()
+    if section == 'pending_challenges':
+        return tuple(uid for uid in (value.get('to_user'), value.get('from_user')) if uid)
+    if section in ('tasks', 'quests', 'challenges', 'social'):
+        user_id = value.get('user_id')
+        return (user_id,) if user_id else ()
+    return ()
+
+
+class OwnerIndex:
+    """user_id -> row keys for the per-user sections of an in-memory document.
+
+    Built once when the document is loaded and updated row by row as changes
+    are applied, so a user scoped load costs O(that user's rows) instead of a
+    scan over every task, challenge and pending invite.
+    """
+
+    def __init__(self, document=None):
+        self.keys = {section: {} for section in USER_SECTIONS}
+        for section in USER_SECTIONS:
+            for key, value in (document or {}).get(section, {}).items():
+                self.add(section, key, value)
+
+    def add(self, section, key, value):
+        if section in self.keys:
+            for user_id in row_owners(section, key, value):
+                self.keys[section].setdefault(user_id, set()).add(key)
+
+    def remove(self, section, key, value):
+        if section in self.keys:
+            for user_id in row_owners(section, key, value):
+                keys = self.keys[section].get(user_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.keys[section][user_id]
+
+    def lookup(self, section, user_id):
+        return self.keys.get(section, {}).get(user_id, ())
+
+
+class Document(dict):
+    """The data dict handed to request handlers.
+
+    Besides the sections themselves it remembers the encoded form of every row
+    it was loaded with, so save() can work out which rows were added, changed
+    or deleted without rewriting the rest.
+    """
+
+    def __init__(self, rows=None, scope=None):
+        super().__init__({section: {} for section in SECTIONS})
+        self.scope = scope
+        self.baseline = {}
+        for section, section_rows in (rows or {}).items():
+            self[section] = {}
+            baseline = self.baseline.setdefault(section, {})
+            for key, text in section_rows.items():
+                self[section][key] = decode_row(text)
+                baseline[key] = text
+
+    def changes(self):
+        """List (section, key, encoded_row) for every changed row; None marks a delete"""
+        changed = []
+        for section, rows in self.items():
+            if not isinstance(rows, dict):
+                raise ValueError(f'Section {section!r} must be a dict')
+            baseline = self.baseline.get(section, {})
+            for key, value in rows.items():
+                text = encode_row(value)
+                if baseline.get(key) != text:
+                    changed.append((section, key, text))
+            for key in baseline:
+                if key not in rows:
+                    changed.append((section, key, None))
+        for section, baseline in self.baseline.items():
+            if section not in self:
+                changed.extend((section, key, None) for key in baseline)
+        return changed
+
+    def mark_saved(self, changes):
+        """Fold written changes into the baseline so the next save only sees new edits"""
+        for section, key, text in changes:
+            baseline = self.baseline.setdefault(section, {})
+            if text is None:
+                baseline.pop(key, None)
+            else:
+                baseline[key] = text
+
+
+class BaseStore:
+    """Common load/save logic; backends implement read_rows() and apply()"""
+
+    def __init__(self):
+        self._listeners = []
+        self.loads = 0
+
+    def add_listener(self, listener):
+        """Call listener(changes) after every successful write made by this process"""
+        self._listeners.append(listener)
+
+    def _notify(self, changes):
+        for listener in self._listeners:
+            listener(changes)
+
+    def load(self, user_id=None, sections=None):
+        """Load the document, optionally only one user's rows and/or some sections"""
+        wanted = tuple(sections) if sections else SECTIONS
+        self.loads += 1
+        rows = self.read_rows(user_id, wanted)
+        return Document(rows, scope=user_id)
+
+    def save(self, doc, event=None):
+        """Persist every row of doc that changed since it was loaded.
+
+        event names the kind of mutation (task_completed, item_purchased, ...)
+        for backends that record it.
+        """
+        changes = doc.changes()
+        if changes:
+            # The loaded text of each row is its version: if any of them moved
+            # on in the meantime apply() raises ConflictError and writes nothing
+            expected = {(section, key): doc.baseline.get(section, {}).get(key)
+                        for section, key, text in changes}
+            self.apply(changes + self.version_changes(changes, expected), event, expected)
+            doc.mark_saved(changes)
+            self._notify(changes)
+        return changes
+
+    def version_changes(self, changes, expected):
+        """A new version row for every user owning one of the changed rows.
+
+        The rows aren't checked for conflicts: any new value will do, as long
+        as it differs from what readers saw before.
+        """
+        owners = set()
+        for section, key, text in changes:
+            if section == VERSIONS_SECTION:
+                continue
+            source = text if text is not None else expected.get((section, key))
+            owners.update(row_owners(section, key, decode_row(source) if source is not None else None))
+        stamp = time.time_ns()
+        return [(VERSIONS_SECTION, user_id,
+                 encode_row({'user_id': user_id, 'version': f'{stamp:x}', 'modified': stamp}))
+                for user_id in sorted(owners)]
+
+    def user_version(self, user_id):
+        """(tag, modified datetime) that changes whenever one of user_id's rows is saved.
+
+        Cheap enough to check before loading anything; None if the user has
+        not been saved since versions were introduced.
+        """
+        text = self.read_rows(user_id, (VERSIONS_SECTION,)).get(VERSIONS_SECTION, {}).get(user_id)
+        if text is None:
+            return None
+        version = decode_row(text)
+        return version['version'], datetime.fromtimestamp(version['modified'] / 1e9)
+
+    def read_rows(self, user_id, sections):
+        raise NotImplementedError
+
+    def apply(self, changes, event=None, expected=None):
+        raise NotImplementedError
+
+    def user_exists(self, user_id):
+        return bool(self.read_rows(user_id, ('users',)).get('users'))
+
+    def user_summaries(self):
+        """Return {user_id: summary} with the SUMMARY_FIELDS of every user"""
+        users = self.load(sections=('users',))['users']
+        return {user_id: user_summary(user) for user_id, user in users.items()}
+
+    def stats(self):
+        """Counters for the admin storage stats endpoint"""
+        return {'backend': type(self).__name__, 'loads': self.loads}
+
+    def import_document(self, document):
+        """Write every row of a plain user_data.json style dict into this store"""
+        changes = []
+        for section, rows in document.items():
+            if not isinstance(rows, dict):
+                continue
+            changes.extend((section, key, encode_row(value)) for key, value in rows.items())
+        if changes:
+            self.apply(changes, 'imported')
+            self._notify(changes)
+        return len(changes)
+
+
+class CommitBatch:
+    """Saves that become durable with the same snapshot write"""
+
+    def __init__(self):
+        self.opened = time.monotonic()
+        self.size = 0
+        self.error = None
+        self.done = threading.Event()
+
+
+class JsonStore(BaseStore):
+    """The original single user_data.json file.
+
+    The parsed file is kept in memory and only re-read when its mtime, size or
+    inode change, i.e. when another process wrote it.
+
+    With commit_window set (seconds, 0 allowed) saves are group committed: each
+    one applies its rows to the in-memory document and waits while a writer
+    thread writes the snapshot once for every save that arrived within the
+    window (or until commit_max_batch of them are waiting).  This process keeps
+    the file lock from the first save of a batch until it is on disk, so other
+    workers can't write in between.  Reads in this process may see rows a
+    moment before they are durable.
+    """
+
+    def __init__(self, path, codec=None, commit_window=None, commit_max_batch=64):
+        super().__init__()
+        self.path = path
+        self.codec = codec or CODECS['json']
+        self._lock = threading.RLock()
+        self._document = None
+        self._index = None
+        self._stamp = None
+        self.hits = 0
+        self.misses = 0
+        self.commit_window = commit_window
+        self.commit_max_batch = commit_max_batch
+        self.commits = 0
+        self.committed_saves = 0
+        self._batch = None
+        self._batch_changed = threading.Condition(self._lock)
+        self._commit_lock = None
+        self._holding = False
+        self._acquiring = False
+        self._writing = False
+        self._writer = None
+        self._writer_pid = None
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def read_document(self):
+        """Return the cached parsed file, re-reading it if it changed on disk"""
+        with self._lock:
+            stamp = self._file_stamp()
+            if self._document is not None and stamp == self._stamp:
+                self.hits += 1
+                return self._document
+            self.misses += 1
+            document = read_snapshot(self.path) if stamp is not None else {}
+            self._document = document
+            self._index = OwnerIndex(document)
+            self._stamp = stamp
+            return document
+
+    def _put_row(self, document, section, key, value):
+        """Set (or delete, for None) one row and keep the owner index in step"""
+        rows = document.setdefault(section, {})
+        old = rows.get(key)
+        if old is not None:
+            self._index.remove(section, key, old)
+        if value is None:
+            rows.pop(key, None)
+        else:
+            rows[key] = value
+            self._index.add(section, key, value)
+
+    def _apply_changes(self, document, changes):
+        for section, key, text in changes:
+            self._put_row(document, section, key, decode_row(text) if text is not None else None)
+
+    def write_snapshot(self, document):
+        write_snapshot(self.path, document, self.codec)
+
+    def write_document(self, document):
+        self.write_snapshot(document)
+        self._document = document
+        self._stamp = self._file_stamp()
+
+    def read_rows(self, user_id, sections):
+        # Rows are encoded here, so handlers never share objects with the cache
+        with self._lock:
+            return self._read_rows(self.read_document(), user_id, sections)
+
+    def _read_rows(self, document, user_id, sections):
+        rows = {}
+        for section in sections:
+            section_rows = document.get(section) or {}
+            if user_id is not None and section in USER_SECTIONS:
+                section_rows = {key: section_rows[key] for key in self._index.lookup(section, user_id)
+                                if key in section_rows}
+            elif user_id is not None:
+                continue
+            rows[section] = {key: encode_row(value) for key, value in section_rows.items()}
+        return rows
+
+    def apply(self, changes, event=None, expected=None):
+        if self.commit_window is not None:
+            return self._apply_grouped(changes, expected)
+        with self._lock, file_lock(f'{self.path}.lock'):
+            document = self.read_document()
+            check_expected(expected, document_text(document))
+            try:
+                self._apply_changes(document, changes)
+                self.write_document(document)
+            except BaseException:
+                # The cached copy no longer matches the file
+                self._document = None
+                raise
+
+    # ---- group commit ----
+
+    def _apply_grouped(self, changes, expected):
+        with self._lock:
+            self._start_writer()
+        while True:
+            with self._lock:
+                if self._holding:
+                    batch = self._add_to_batch(changes, expected)
+                    break
+                if self._acquiring:
+                    # Another thread is waiting for the file lock on our behalf
+                    self._batch_changed.wait()
+                    continue
+                self._acquiring = True
+            # Wait for other workers outside self._lock so this worker's reads carry on
+            try:
+                handle = lock_file(f'{self.path}.lock')
+            except BaseException:
+                with self._lock:
+                    self._acquiring = False
+                    self._batch_changed.notify_all()
+                raise
+            with self._lock:
+                self._acquiring = False
+                self._commit_lock = handle
+                self._holding = True
+                self._batch_changed.notify_all()
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+
+    def _add_to_batch(self, changes, expected):
+        """Check and apply one save under the file lock; returns the batch that will write it"""
+        try:
+            document = self.read_document()
+            check_expected(expected, document_text(document))
+            try:
+                self._apply_changes(document, changes)
+            except BaseException:
+                # Fails the open batch too: the writer finds no document to write
+                self._document = None
+                raise
+        except BaseException:
+            if self._batch is None and not self._writing:
+                self._release_commit_lock()
+            raise
+        if self._batch is None:
+            self._batch = CommitBatch()
+        self._batch.size += 1
+        self._batch_changed.notify_all()
+        return self._batch
+
+    def _release_commit_lock(self):
+        unlock_file(self._commit_lock)
+        self._commit_lock = None
+        self._holding = False
+
+    def _start_writer(self):
+        if self._writer_pid == os.getpid() and self._writer.is_alive():
+            return
+        if self._writer_pid is not None and self._writer_pid != os.getpid():
+            # Forked: the parent's pending batch and file lock are not ours
+            self._batch = None
+            self._commit_lock = None
+            self._holding = False
+            self._acquiring = False
+            self._writing = False
+            self._document = None
+        self._writer_pid = os.getpid()
+        self._writer = threading.Thread(target=self._run_writer, daemon=True)
+        self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            with self._lock:
+                while self._batch is None:
+                    self._batch_changed.wait()
+                batch = self._batch
+                deadline = batch.opened + self.commit_window
+                while batch.size < self.commit_max_batch and time.monotonic() < deadline:
+                    self._batch_changed.wait(deadline - time.monotonic())
+                # Later saves go to the next batch (still under our file lock)
+                self._batch = None
+                self._writing = True
+                # _put_row replaces rows instead of mutating them, so
+                # copying the section dicts is enough for a consistent snapshot
+                snapshot = ({section: dict(rows) for section, rows in self._document.items()}
+                            if self._document is not None else None)
+            try:
+                if snapshot is None:
+                    raise RuntimeError('Document was dropped before it was written')
+                tmp_path = write_temp_snapshot(self.path, snapshot, self.codec)
+                with self._lock:
+                    os.replace(tmp_path, self.path)
+                    self._stamp = self._file_stamp()
+                    self.commits += 1
+                    self.committed_saves += batch.size
+                    self._writing = False
+                    if self._batch is None:
+                        self._release_commit_lock()
+            except Exception as e:
+                with self._lock:
+                    # The saves already applied for the next batch are lost with this one
+                    failed = [batch, self._batch] if self._batch is not None else [batch]
+                    self._batch = None
+                    self._document = None
+                    self._writing = False
+                    self._release_commit_lock()
+                for failed_batch in failed:
+                    failed_batch.error = e
+                    failed_batch.done.set()
+                continue
+            batch.done.set()
+
+    def stats(self):
+        stats = {**super().stats(), 'cache_hits': self.hits, 'cache_misses': self.misses}
+        if self.commit_window is not None:
+            stats.update(commits=self.commits, committed_saves=self.committed_saves)
+        return stats
+
+
+class JournalStore(JsonStore):
+    """user_data.json as a snapshot plus an append-only journal of mutations.
+
+    Every save appends one fsync'd line naming the mutation and the rows it
+    wrote, so a write costs as much as the change.  The journal is replayed on
+    top of the snapshot at startup (and whenever another process appended to
+    it) and folded into a new snapshot in the background once it grows past
+    compact_bytes.  Replaying a row put or delete twice gives the same result,
+    so a crash at any point of a compaction is harmless.
+    """
+
+    def __init__(self, path, compact_bytes=1024 * 1024, codec=None):
+        super().__init__(path, codec)
+        self.journal_path = f'{path}.journal'
+        self.compact_bytes = compact_bytes
+        self._journal_inode = None
+        self._journal_offset = 0
+        self._compactor = None
+        self.replays = 0
+        self.compactions = 0
+        with self._lock, file_lock(f'{self.journal_path}.lock'):
+            self._reload(truncate_torn=True)
+
+    def _journal_stat(self):
+        try:
+            return os.stat(self.journal_path)
+        except FileNotFoundError:
+            return None
+
+    def read_document(self):
+        """Return the in-memory document, replaying journal lines other processes appended"""
+        with self._lock:
+            st = self._journal_stat()
+            inode = st.st_ino if st else None
+            size = st.st_size if st else 0
+            if self._document is not None and inode == self._journal_inode:
+                if size == self._journal_offset:
+                    self.hits += 1
+                    return self._document
+                if size > self._journal_offset:
+                    self.replays += 1
+                    self._replay(self._document, self._journal_offset)
+                    return self._document
+            self.misses += 1
+            self._reload()
+            return self._document
+
+    def _reload(self, truncate_torn=False):
+        while True:
+            st = self._journal_stat()
+            document = read_snapshot(self.path) if os.path.exists(self.path) else {}
+            after = self._journal_stat()
+            # A compaction swapped the journal while we read the snapshot
+            if (st and st.st_ino) != (after and after.st_ino):
+                continue
+            self._document = document
+            self._index = OwnerIndex(document)
+            self._journal_inode = after.st_ino if after else None
+            self._journal_offset = 0
+            if after:
+                self._replay(document, 0, truncate_torn)
+            return
+
+    def _replay(self, document, offset, truncate_torn=False):
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn write from a crash: drop it so new lines start clean
+                    if truncate_torn:
+                        os.truncate(self.journal_path, offset)
+                    break
+                entry = decode_row(line)
+                for section, key, value in entry['changes']:
+                    self._put_row(document, section, key, value)
+                offset += len(line)
+        self._journal_offset = offset
+
+    def apply(self, changes, event=None, expected=None):
+        with self._lock, file_lock(f'{self.journal_path}.lock'):
+            document = self.read_document()
+            check_expected(expected, document_text(document))
+            line = self._journal_line(changes, event)
+            fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+                st = os.fstat(fd)
+            finally:
+                os.close(fd)
+            self._apply_changes(document, changes)
+            if st.st_ino == self._journal_inode and st.st_size == self._journal_offset + len(line):
+                self._journal_offset = st.st_size
+            elif self._journal_inode is None and st.st_size == len(line):
+                self._journal_inode = st.st_ino
+                self._journal_offset = st.st_size
+            else:
+                # Someone else wrote in between; rebuild from disk on the next read
+                self._document = None
+            if self._journal_offset >= self.compact_bytes:
+                self.compact_in_background()
+
+    def _journal_line(self, changes, event):
+        parts = []
+        for section, key, text in changes:
+            parts.append(f'[{json.dumps(section)},{json.dumps(key)},{text if text is not None else "null"}]')
+        header = json.dumps({'type': event or 'update', 'at': datetime.now().isoformat()})
+        return f'{header[:-1]},"changes":[{",".join(parts)}]}}\n'.encode('utf-8')
+
+    def compact_in_background(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, daemon=True)
+        self._compactor.start()
+
+    def compact(self):
+        """Write the current state as a new snapshot and drop the journal lines it covers"""
+        with self._lock:
+            document = self.read_document()
+            # _put_row replaces rows instead of mutating them, so
+            # copying the section dicts is enough for a consistent snapshot
+            snapshot = {section: dict(rows) for section, rows in document.items()}
+            covered = self._journal_offset
+            inode = self._journal_inode
+        # Written without the journal lock, so each compactor needs its own temp file
+        snapshot_tmp = write_temp_snapshot(self.path, snapshot, self.codec,
+                                           f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with self._lock, file_lock(f'{self.journal_path}.lock'):
+            st = self._journal_stat()
+            if st is None or st.st_ino != inode:
+                # Another process compacted first; its snapshot is at least as new
+                os.remove(snapshot_tmp)
+                return
+            # Catch up on lines other processes appended since the snapshot was
+            # taken: they stay in the journal, but this process won't replay them again
+            self.read_document()
+            os.replace(snapshot_tmp, self.path)
+            tmp_path = f'{self.journal_path}.tmp'
+            with open(self.journal_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                src.seek(covered)
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, self.journal_path)
+            st = self._journal_stat()
+            if self._document is not None:
+                self._journal_inode = st.st_ino
+                self._journal_offset = st.st_size
+            self.compactions += 1
+
+    def stats(self):
+        return {**super().stats(), 'journal_bytes': self._journal_offset,
+                'journal_replays': self.replays, 'compactions': self.compactions}
+
+
+class SqliteStore(BaseStore):
+    """SQLite (WAL) backend with one table per section and user_id indexes"""
+
+    # section -> indexed columns extracted from the row besides its id
+    TABLES = {
+        'users': (),
+        'tasks': ('user_id',),
+        'quests': ('user_id',),
+        'challenges': ('user_id',),
+        'social': ('user_id', 'timestamp'),
+        'pending_challenges': ('from_user', 'to_user'),
+        'active_quests': (),
+        'completed_quests': (),
+        'completions': (),
+        'task_sync': (),
+        'versions': (),
+    }
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._create_schema()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self.connection()
+        for table, columns in self.TABLES.items():
+            extra = ''.join(f', {column} TEXT' for column in columns)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY{extra}, body TEXT NOT NULL)')
+            for column in columns:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})')
+        # Sections without a dedicated table (achievements, quest_templates, ...)
+        conn.execute('CREATE TABLE IF NOT EXISTS documents '
+                     '(section TEXT NOT NULL, id TEXT NOT NULL, body TEXT NOT NULL, PRIMARY KEY (section, id))')
+
+    def _select(self, section, user_id):
+        conn = self.connection()
+        if section not in self.TABLES:
+            if user_id is not None:
+                return []
+            return conn.execute('SELECT id, body FROM documents WHERE section = ?', (section,))
+        columns = self.TABLES[section]
+        if user_id is None:
+            return conn.execute(f'SELECT id, body FROM {section}')
+        if section in USER_SECTIONS and not columns:
+            return conn.execute(f'SELECT id, body FROM {section} WHERE id = ?', (user_id,))
+        if section == 'pending_challenges':
+            return conn.execute('SELECT id, body FROM pending_challenges WHERE to_user = ? OR from_user = ?',
+                                (user_id, user_id))
+        if section in USER_SECTIONS:
+            return conn.execute(f'SELECT id, body FROM {section} WHERE user_id = ?', (user_id,))
+        return []
+
+    def read_rows(self, user_id, sections):
+        rows = {}
+        for section in sections:
+            if user_id is not None and section not in USER_SECTIONS:
+                continue
+            rows[section] = dict(self._select(section, user_id))
+        return rows
+
+    def apply(self, changes, event=None, expected=None):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            check_expected(expected, lambda section, key: self._current_text(conn, section, key))
+            for section, key, text in changes:
+                self._apply_one(conn, section, key, text)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _current_text(self, conn, section, key):
+        if section in self.TABLES:
+            row = conn.execute(f'SELECT body FROM {section} WHERE id = ?', (key,)).fetchone()
+        else:
+            row = conn.execute('SELECT body FROM documents WHERE section = ? AND id = ?', (section, key)).fetchone()
+        return row[0] if row else None
+
+    def _apply_one(self, conn, section, key, text):
+        if section not in self.TABLES:
+            if text is None:
+                conn.execute('DELETE FROM documents WHERE section = ? AND id = ?', (section, key))
+            else:
+                conn.execute('INSERT OR REPLACE INTO documents (section, id, body) VALUES (?, ?, ?)',
+                             (section, key, text))
+            return
+        if text is None:
+            conn.execute(f'DELETE FROM {section} WHERE id = ?', (key,))
+            return
+        columns = self.TABLES[section]
+        value = decode_row(text) if columns else None
+        values = [value.get(column) if isinstance(value, dict) else None for column in columns]
+        names = ''.join(f', {column}' for column in columns)
+        marks = ', ?' * len(columns)
+        conn.execute(f'INSERT OR REPLACE INTO {section} (id{names}, body) VALUES (?{marks}, ?)',
+                     [key, *values, text])
+
+    def user_exists(self, user_id):
+        row = self.connection().execute('SELECT 1 FROM users WHERE id = ?', (user_id,)).fetchone()
+        return row is not None
+
+
+class ShardedStore(BaseStore):
+    """One JSON file per user plus small global files.
+
+    users/<user_id>.json holds a user's profile, tasks, quests and challenges,
+    so requests for different users never touch the same file.  Social shares
+    and pending challenges live in social.json and pending_challenges.json,
+    other sections in global.json.  The SUMMARY_FIELDS of every user (for the
+    leaderboards and the user list) are read from the shards and cached per
+    file, so saves never write a file shared by all users.
+    """
+
+    def __init__(self, root, codec=None):
+        super().__init__()
+        self.root = root
+        self.codec = codec or CODECS['json']
+        # shard path -> (file stamp, {user_id: summary})
+        self._summaries = {}
+        self._summaries_lock = threading.Lock()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(os.path.join(root, 'users'), exist_ok=True)
+
+    def shard_path(self, user_id):
+        return os.path.join(self.root, 'users', f"{quote(user_id, safe='')}.json")
+
+    def global_path(self, section):
+        if section in ('social', 'pending_challenges'):
+            return os.path.join(self.root, f'{section}.json')
+        return os.path.join(self.root, 'global.json')
+
+    def _lock_for(self, path):
+        with self._locks_guard:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def _read_file(self, path):
+        try:
+            return read_snapshot(path)
+        except FileNotFoundError:
+            return {}
+
+    def _write_file(self, path, document):
+        write_snapshot(path, document, self.codec)
+
+    def _target(self, section, key, value):
+        if section in SHARD_SECTIONS:
+            owners = row_owners(section, key, value)
+            if owners:
+                return self.shard_path(owners[0])
+        return self.global_path(section)
+
+    def read_rows(self, user_id, sections):
+        files = []
+        if user_id is None:
+            # Global sections (meta, social, ...) don't need the user shards opened
+            if any(section in SHARD_SECTIONS for section in sections):
+                users_dir = os.path.join(self.root, 'users')
+                files.extend(os.path.join(users_dir, name) for name in os.listdir(users_dir)
+                             if name.endswith('.json'))
+                # Shard rows without an owner fall back to global.json
+                files.append(self.global_path('users'))
+            files.extend({self.global_path(section) for section in sections if section not in SHARD_SECTIONS})
+        else:
+            files.append(self.shard_path(user_id))
+            if 'pending_challenges' in sections:
+                files.append(self.global_path('pending_challenges'))
+        rows = {section: {} for section in sections if user_id is None or section in USER_SECTIONS}
+        for path in dict.fromkeys(files):
+            for section, section_rows in self._read_file(path).items():
+                if section not in rows:
+                    continue
+                for key, value in section_rows.items():
+                    if user_id is None or user_id in row_owners(section, key, value):
+                        rows[section][key] = encode_row(value)
+        return rows
+
+    def apply(self, changes, event=None, expected=None):
+        expected = expected or {}
+        by_path = {}
+        for section, key, text in changes:
+            # Deleted rows are routed by the row they replaced
+            source = text if text is not None else expected.get((section, key))
+            value = decode_row(source) if source is not None else None
+            by_path.setdefault(self._target(section, key, value), []).append((section, key, text))
+        with ExitStack() as stack:
+            # Lock every touched file in a fixed order and check them all
+            # before writing any, so a conflict never leaves half a save behind
+            documents = {}
+            for path in sorted(by_path):
+                stack.enter_context(self._lock_for(path))
+                stack.enter_context(file_lock(f'{path}.lock'))
+                documents[path] = self._read_file(path)
+            for path, path_changes in by_path.items():
+                check_expected({(section, key): expected[(section, key)] for section, key, _ in path_changes
+                                if (section, key) in expected},
+                               document_text(documents[path]))
+            for path, path_changes in by_path.items():
+                apply_to_document(documents[path], path_changes)
+                self._write_file(path, documents[path])
+
+    def user_exists(self, user_id):
+        return user_id in self._read_file(self.shard_path(user_id)).get('users', {})
+
+    def version_changes(self, changes, expected):
+        # A user's shard file changes with every save of their rows already
+        return []
+
+    def user_version(self, user_id):
+        try:
+            st = os.stat(self.shard_path(user_id))
+        except FileNotFoundError:
+            return None
+        return f'{st.st_mtime_ns:x}-{st.st_size:x}-{st.st_ino:x}', datetime.fromtimestamp(st.st_mtime)
+
+    def user_summaries(self):
+        # A stat per shard; only shards rewritten since the last call are read
+        users_dir = os.path.join(self.root, 'users')
+        with self._summaries_lock:
+            summaries = {}
+            for name in os.listdir(users_dir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(users_dir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+                cached = self._summaries.get(path)
+                if cached is None or cached[0] != stamp:
+                    users = self._read_file(path).get('users', {})
+                    cached = (stamp, {user_id: user_summary(user) for user_id, user in users.items()})
+                summaries[path] = cached
+            self._summaries = summaries
+        return {user_id: summary for _, shard in summaries.values() for user_id, summary in shard.items()}
+
+
+def create_store(backend, json_path, sqlite_path, compact_bytes=1024 * 1024, shard_root='user_data',
+                 codec='json', commit_window=None, commit_max_batch=64):
+    """Build the store selected by the STORAGE_BACKEND and STORAGE_CODEC settings"""
+    if codec not in CODECS:
+        raise ValueError(f'Unknown storage codec: {codec}')
+    if backend == 'json':
+        return JsonStore(json_path, CODECS[codec], commit_window, commit_max_batch)
+    if backend == 'journal':
+        return JournalStore(json_path, compact_bytes, CODECS[codec])
+    if backend == 'sqlite':
+        return SqliteStore(sqlite_path)
+    if backend == 'sharded':
+        return ShardedStore(shard_root, CODECS[codec])
+    raise ValueError(f'Unknown storage backend: {backend}')
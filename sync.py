@@ -0,0 +1,52 @@
+"""Change versions for delta syncing a user's tasks.
+
+data['task_sync'][user_id] holds {'user_id': ..., 'version': n, 'deleted': {task_id: version}}.
+Every write to a task bumps the user's counter and stamps the task with it;
+deleting a task leaves a tombstone at the new version instead.  A client that
+last synced at version v then only needs the tasks and tombstones newer than v.
+"""
+
+# Tombstones kept per user; a client that synced before the oldest dropped one gets a full list
+TOMBSTONE_LIMIT = 500
+
+
+def task_sync(data, user_id):
+    """The user's sync row, created if missing"""
+    return data.setdefault('task_sync', {}).setdefault(user_id, {'user_id': user_id, 'version': 0, 'deleted': {}})
+
+
+def _bump(sync):
+    sync['version'] += 1
+    return sync['version']
+
+
+def touch_task(data, user_id, task):
+    """Record that task was created or changed"""
+    task['version'] = _bump(task_sync(data, user_id))
+
+
+def tombstone(data, user_id, task_id):
+    """Record that task_id was deleted"""
+    sync = task_sync(data, user_id)
+    deleted = sync['deleted']
+    deleted[task_id] = _bump(sync)
+    if len(deleted) > TOMBSTONE_LIMIT:
+        # Insertion order is version order
+        for old_id in list(deleted)[:len(deleted) - TOMBSTONE_LIMIT]:
+            sync['pruned_through'] = deleted.pop(old_id)
+
+
+def changes_since(data, user_id, since):
+    """(tasks, deleted ids, full) changed after version since.
+
+    full is True when tombstones the client needs were already pruned (or
+    since is not a version of this user); tasks is then every task of the user
+    and the client should replace its list.
+    """
+    sync = task_sync(data, user_id)
+    tasks = [task for task in data['tasks'].values() if task.get('user_id') == user_id]
+    if since < sync.get('pruned_through', 0) or since > sync['version']:
+        return tasks, [], True
+    changed = [task for task in tasks if task.get('version', 0) > since]
+    deleted = [task_id for task_id, version in sync['deleted'].items() if version > since]
+    return changed, deleted, False
@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta
+
+from activity import completion_log, count_between, events_between, record_completion
+
+
+def test_count_between_includes_completion_in_the_same_second_as_start():
+    data = {}
+    log = completion_log(data, 'u1')
+    start = datetime(2026, 1, 5, 12, 0, 0, 500000)
+    record_completion(log, 't0', start - timedelta(seconds=1))
+    record_completion(log, 't1', start.replace(microsecond=900000))
+    record_completion(log, 't2', start + timedelta(seconds=1))
+
+    assert count_between(log, start) == 2
+    assert count_between(log, start, start + timedelta(seconds=1)) == 1
+    assert [task_id for _, task_id in events_between(log, start, start + timedelta(seconds=2))] == ['t1', 't2']
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import rules
+from activity import completion_log, record_completion
+
+CHALLENGE_TEMPLATES = {'task_sprint': {'tasks_required': 10, 'duration_hours': 24},
+                       'daily_grind': {'tasks_required': 3, 'duration_hours': 24}}
+
+
+def bulk_complete(engine, data, user_id, task_ids, at):
+    """What apply_complete_tasks does: log every completion, then one process() call"""
+    log = completion_log(data, user_id)
+    for task_id in task_ids:
+        record_completion(log, task_id, at)
+    return engine.process(data, user_id, [rules.task_completed(task_id, at) for task_id in task_ids])
+
+
+def test_bulk_complete_counts_each_completion_once_for_legacy_challenge():
+    now = datetime.now()
+    data = {
+        'users': {'u1': {'xp': 0, 'coins': 0, 'level': 1, 'streak': 0}},
+        # Started before progress was tracked incrementally: no 'tracked' flag
+        'challenges': {'c1': {'user_id': 'u1', 'template_id': 'task_sprint', 'progress': 0,
+                              'started_at': (now - timedelta(hours=1)).isoformat(),
+                              'duration_hours': 24, 'xp_reward': 50, 'coin_reward': 25}},
+    }
+    engine = rules.RulesEngine({}, CHALLENGE_TEMPLATES, {})
+
+    bulk_complete(engine, data, 'u1', ['t1', 't2', 't3'], now)
+    assert data['challenges']['c1']['progress'] == 3
+    assert data['challenges']['c1']['tracked']
+
+    bulk_complete(engine, data, 'u1', ['t4', 't5'], now)
+    assert data['challenges']['c1']['progress'] == 5
+
+
+def test_challenge_accepted_then_completed_in_the_same_second():
+    now = datetime.now()
+    data = {'users': {'u1': {'xp': 0, 'coins': 0, 'level': 1, 'streak': 0}}, 'challenges': {}}
+    engine = rules.RulesEngine({}, CHALLENGE_TEMPLATES, {})
+
+    # What respond_pending_challenge does on accept
+    challenge = {'user_id': 'u1', 'template_id': 'daily_grind', 'progress': 0, 'completed': False,
+                 'started_at': now.isoformat(), 'duration_hours': 24, 'xp_reward': 50, 'coin_reward': 25}
+    engine.seed_challenge(challenge, data)
+    data['challenges']['c1'] = challenge
+
+    quests, challenges = bulk_complete(engine, data, 'u1', ['t1', 't2', 't3'], now)
+    assert challenges == [challenge]
+    assert challenge['completed'] and challenge['progress'] == 3
+    assert data['users']['u1']['coins'] == 25